@@ -0,0 +1,248 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any
+
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from model import ActionType, CoordinatorModel, ShareVerification
+from roast import keygen, share_val, verify
+from tracing import make_tracer, timed
+from transport import MAX_RUNS, encode_frame, encode_sign_frames, read_obj
+
+@dataclass
+class RunState:
+    run_id: int
+    model: Any
+    attacker_strategy: Any
+    done: Any
+    send_count: int = 0
+    recv_count: int = 0
+    # Only used with tracing on
+    trace: Any = None
+    i_to_sent_at: dict = field(default_factory=dict)
+
+class AsyncCoordinator:
+    # Same interface as Coordinator, but a single event loop owns all
+    # participant connections and calls CoordinatorModel.handle_incoming
+    # directly, instead of passing every message through per-connection
+    # processes and multiprocessing queues. Only share verification is
+    # offloaded, to a process pool with the given number of workers.
+    #
+    # Every signing request is a run of its own, with messages tagged by
+    # its run_id, so many requests (each with its own CoordinatorModel) can
+    # be in flight at once over the same connections; see sign and
+    # sign_many.
+    def __init__(self, share_verification=ShareVerification.EAGER, workers=None):
+        self.share_verification = share_verification
+        self.workers = workers or os.cpu_count()
+        self.loop = asyncio.new_event_loop()
+        self.pool = None
+        self.writers = {}
+        self.tasks = []
+        self.run_id = 0
+        self.run_id_to_state = {}
+        # Nonce commitments uploaded by participants with NONCES messages
+        self.i_to_nonces = defaultdict(deque)
+        # With tracing on (see tracing.py), trace holds the RunTrace of the
+        # latest run to finish
+        self.tracer = make_tracer()
+        self.trace = None
+
+    def setup(self, i_to_addr):
+        # The pool is started after any precomputed tables have been built,
+        # so that the forked workers inherit them
+        if self.share_verification == ShareVerification.EAGER:
+            self.pool = ProcessPoolExecutor(self.workers)
+        self.loop.run_until_complete(self.connect(i_to_addr))
+
+    async def connect(self, i_to_addr):
+        for i, (host, port) in i_to_addr.items():
+            reader, writer = await asyncio.open_connection(host, port)
+            self.writers[i] = writer
+            self.tasks.append(self.loop.create_task(self.read_loop(reader)))
+            logging.debug(f'Established connection to participant {i} at {(host, port)}')
+
+    def send_frame(self, i, frame):
+        # Each connection has its own buffered writer, so this never waits
+        # for a slow socket
+        self.writers[i].write(frame)
+
+    async def read_loop(self, reader):
+        while True:
+            obj = await read_obj(reader)
+            if obj is None:
+                break
+            received_at = time.monotonic()
+            msg_run_id, (i, s_i, pre_i) = obj
+            if type(pre_i) is list:
+                self.i_to_nonces[i].extend(pre_i)
+                continue
+            state = self.run_id_to_state.get(msg_run_id)
+            if state is None:
+                logging.debug(f'Ignoring incoming message from finished or unknown run (message run_id = {msg_run_id})')
+                continue
+            state.recv_count += 1
+            trace = state.trace
+            if trace is not None:
+                sent_at = state.i_to_sent_at.pop(i, None)
+                if sent_at is not None:
+                    trace.record('init_round_trip' if s_i is None else 'round_trip', received_at - sent_at, i=i)
+
+            model = state.model
+            share_is_valid = False
+            if s_i is not None and self.share_verification == ShareVerification.EAGER and i in model.i_to_sid and i not in model.malicious:
+                # Only send the worker what share_val needs for this
+                # participant, instead of the whole i_to_X map
+                ctx = model.share_context(i)
+                ctx = ctx._replace(i_to_X={i: ctx.i_to_X[i]}, i_to_lambda={i: ctx.i_to_lambda[i]})
+                # Includes waiting for a worker, when traced
+                start = time.perf_counter()
+                share_is_valid = await self.loop.run_in_executor(self.pool, share_val, ctx, i, s_i)
+                if trace is not None:
+                    trace.record('share_val', time.perf_counter() - start, i=i)
+                if self.run_id_to_state.get(msg_run_id) is not state:
+                    continue
+            self.handle_incoming(state, i, s_i, pre_i, share_is_valid)
+
+    def handle_incoming(self, state, i, s_i, pre_i, share_is_valid):
+        model = state.model
+        if s_i is None:
+            logging.debug(f'Initial incoming message from participant {i}')
+        else:
+            logging.debug(f'Incoming message from participant {i} in session {model.i_to_sid.get(i)}')
+        action_type, data = timed(state.trace, 'handle_incoming', model.handle_incoming, i, s_i, pre_i, share_is_valid)
+
+        if action_type == ActionType.SESSION_START:
+            sid, ctx, _ = data
+            state.send_count += len(ctx.T)
+            logging.debug(f'Enough participants are ready, starting new session with sid {sid}')
+            session_malicious = state.attacker_strategy.choose_malicious(ctx.T, sid)
+            frames = timed(state.trace, 'serialize', encode_sign_frames, state.run_id, ctx.msg, ctx.T, ctx.pre, sid=sid)
+            if state.trace is not None:
+                sent_at = time.monotonic()
+                for i in ctx.T:
+                    state.i_to_sent_at[i] = sent_at
+            for i in ctx.T:
+                self.send_frame(i, frames[i in session_malicious])
+
+        elif action_type == ActionType.SESSION_SUCCESS:
+            if not state.done.done():
+                state.done.set_result((data, time.time()))
+
+    def run(self, i_to_sk, model, attacker_strategy):
+        return self.loop.run_until_complete(self.sign(i_to_sk, model, attacker_strategy))
+
+    def run_many(self, requests, in_flight):
+        return self.loop.run_until_complete(self.sign_many(requests, in_flight))
+
+    async def sign(self, i_to_sk, model, attacker_strategy):
+        self.run_id += 1
+        run_id = self.run_id
+        state = RunState(run_id, model, attacker_strategy, self.loop.create_future(), send_count=len(i_to_sk))
+        self.run_id_to_state[run_id] = state
+        if self.tracer is not None:
+            state.trace = model.trace = self.tracer.start_run(run_id)
+        trace = state.trace
+
+        i_to_pre = {}
+        for i, sk_i in i_to_sk.items():
+            if self.i_to_nonces[i]:
+                # Use an uploaded nonce instead of waiting for pre_i
+                nonce_id, i_to_pre[i] = self.i_to_nonces[i].popleft()
+                self.send_frame(i, timed(trace, 'serialize', encode_frame, (run_id, (model.X, i, sk_i, nonce_id))))
+            else:
+                frame = timed(trace, 'serialize', encode_frame, (run_id, (model.X, i, sk_i)))
+                if trace is not None:
+                    state.i_to_sent_at[i] = time.monotonic()
+                self.send_frame(i, frame)
+
+        start = time.time()
+
+        # Only after every participant has been sent INIT, since this may
+        # already start sessions
+        for i, pre_i in i_to_pre.items():
+            self.handle_incoming(state, i, None, pre_i, True)
+        try:
+            (ctx, sig, sid), end = await state.done
+        finally:
+            del self.run_id_to_state[run_id]
+        if trace is not None:
+            self.tracer.end_run(trace)
+            self.trace = trace
+            logging.info(f'Trace of run {run_id}: {trace.summary()}')
+        assert verify(ctx, sig)
+        return end - start, state.send_count, state.recv_count, sid
+
+    async def sign_many(self, requests, in_flight):
+        # Signs each (i_to_sk, model, attacker_strategy) request, with up to
+        # in_flight of them running at the same time, and returns the
+        # results of sign in the same order. Participants only keep state
+        # for MAX_RUNS runs, so more requests in flight would never finish.
+        if in_flight > MAX_RUNS:
+            raise ValueError(f'At most {MAX_RUNS} requests can be in flight, got {in_flight}')
+        semaphore = asyncio.Semaphore(in_flight)
+
+        async def sign_one(request):
+            async with semaphore:
+                return await self.sign(*request)
+
+        return await asyncio.gather(*(sign_one(request) for request in requests))
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for writer in self.writers.values():
+            writer.close()
+        self.loop.run_until_complete(asyncio.gather(*self.tasks, return_exceptions=True))
+        self.loop.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.tracer is not None:
+            self.tracer.close()
+
+if __name__ == '__main__':
+    # Measures signing throughput with many requests in flight at once
+    from coordinator import AttackerLevel, AttackerStrategy
+    import fastec
+
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) not in (7, 8):
+        print(f'usage: {sys.argv[0]} <host> <start_port> <threshold> <total> <requests> <in_flight> [share_verification]')
+        sys.exit(1)
+
+    host = sys.argv[1]
+    start_port = int(sys.argv[2])
+    t = int(sys.argv[3])
+    n = int(sys.argv[4])
+    count = int(sys.argv[5])
+    in_flight = int(sys.argv[6])
+    share_verification = ShareVerification(int(sys.argv[7])) if len(sys.argv) == 8 else ShareVerification.EAGER
+    if in_flight > MAX_RUNS:
+        print(f'At most {MAX_RUNS} requests can be in flight')
+        sys.exit(1)
+
+    i_to_addr = {i + 1: (host, start_port + i) for i in range(n)}
+    i_to_sk, X, i_to_X = keygen(t, n)
+    fastec.precompute([X, *i_to_X.values()])
+
+    coordinator = AsyncCoordinator(share_verification)
+    coordinator.setup(i_to_addr)
+
+    requests = []
+    for k in range(count):
+        model = CoordinatorModel(X, i_to_X, t, n, f'request {k}'.encode(), share_verification)
+        requests.append((i_to_sk, model, AttackerStrategy(AttackerLevel.STATIC, n, 0)))
+
+    start = time.time()
+    results = coordinator.run_many(requests, in_flight)
+    elapsed = time.time() - start
+    latencies = sorted(result[0] for result in results)
+    print(f'{count} signatures with {in_flight} in flight: {elapsed:.3f} s, {count / elapsed:.1f} signatures per second, median latency {latencies[len(latencies) // 2]:.4f} s')
+
+    coordinator.close()
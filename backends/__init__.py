@@ -0,0 +1,15 @@
+import importlib
+
+# Backends are only imported when selected, so that e.g. the pure Python
+# backend works without fastecdsa installed
+BACKENDS = {
+    'fastecdsa': ('backends.fastecdsa_backend', 'FastecdsaBackend'),
+    'python': ('backends.python_backend', 'PythonBackend'),
+}
+
+def load_backend(name):
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown EC backend {name!r}, expected one of {sorted(BACKENDS)}')
+    module_name, class_name = BACKENDS[name]
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)()
@@ -0,0 +1,302 @@
+from collections import OrderedDict
+
+import hashlib
+import os
+
+# secp256k1 parameters: y^2 = x^3 + 7 over GF(p), with a group of prime
+# order n generated by (Gx, Gy)
+p = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+n = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+Gx = 0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798
+Gy = 0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8
+
+# Internally we use Jacobian coordinates (X, Y, Z), representing the
+# affine point (X / Z^2, Y / Z^3), so that sums of many points don't need a
+# field inversion per addition. Z == 0 represents the point at infinity.
+jac_infinity = (1, 1, 0)
+
+def jac_double(J):
+    X, Y, Z = J
+    if Z == 0 or Y == 0:
+        return jac_infinity
+    A = X * X % p
+    B = Y * Y % p
+    C = B * B % p
+    D = 2 * ((X + B) * (X + B) - A - C) % p
+    E = 3 * A % p
+    X3 = (E * E - 2 * D) % p
+    Y3 = (E * (D - X3) - 8 * C) % p
+    Z3 = 2 * Y * Z % p
+    return (X3, Y3, Z3)
+
+def jac_add(J1, J2):
+    X1, Y1, Z1 = J1
+    X2, Y2, Z2 = J2
+    if Z1 == 0:
+        return J2
+    if Z2 == 0:
+        return J1
+    Z1Z1 = Z1 * Z1 % p
+    Z2Z2 = Z2 * Z2 % p
+    U1 = X1 * Z2Z2 % p
+    U2 = X2 * Z1Z1 % p
+    S1 = Y1 * Z2 * Z2Z2 % p
+    S2 = Y2 * Z1 * Z1Z1 % p
+    H = (U2 - U1) % p
+    r = (S2 - S1) % p
+    if H == 0:
+        return jac_double(J1) if r == 0 else jac_infinity
+    HH = H * H % p
+    HHH = H * HH % p
+    V = U1 * HH % p
+    X3 = (r * r - HHH - 2 * V) % p
+    Y3 = (r * (V - X3) - S1 * HHH) % p
+    Z3 = Z1 * Z2 * H % p
+    return (X3, Y3, Z3)
+
+def jac_add_affine(J, x2, y2):
+    X1, Y1, Z1 = J
+    if Z1 == 0:
+        return (x2, y2, 1)
+    Z1Z1 = Z1 * Z1 % p
+    U2 = x2 * Z1Z1 % p
+    S2 = y2 * Z1 * Z1Z1 % p
+    H = (U2 - X1) % p
+    r = (S2 - Y1) % p
+    if H == 0:
+        return jac_double(J) if r == 0 else jac_infinity
+    HH = H * H % p
+    HHH = H * HH % p
+    V = X1 * HH % p
+    X3 = (r * r - HHH - 2 * V) % p
+    Y3 = (r * (V - X3) - Y1 * HHH) % p
+    Z3 = Z1 * H % p
+    return (X3, Y3, Z3)
+
+def jac_batch_to_affine(Js):
+    # Montgomery's trick: invert the product of all Z coordinates once, and
+    # recover each individual inverse with a few multiplications. All points
+    # must be finite.
+    prefix = []
+    acc = 1
+    for _, _, Z in Js:
+        prefix.append(acc)
+        acc = acc * Z % p
+    acc_inv = pow(acc, -1, p)
+    affine = [None] * len(Js)
+    for idx in reversed(range(len(Js))):
+        X, Y, Z = Js[idx]
+        z_inv = acc_inv * prefix[idx] % p
+        acc_inv = acc_inv * Z % p
+        z_inv2 = z_inv * z_inv % p
+        affine[idx] = (X * z_inv2 % p, Y * z_inv2 * z_inv % p)
+    return affine
+
+# Fixed-base tables: row j holds d * 2^(w * j) * A in affine coordinates
+# for d = 1, ..., 2^w - 1, so multiplying A by a scalar only takes one
+# mixed addition per w-bit window and no doublings.
+def build_table(x, y, w):
+    size = 2 ** w - 1
+    rows = []
+    base = (x, y, 1)
+    for _ in range(0, n.bit_length(), w):
+        x, y = jac_batch_to_affine([base])[0]
+        row = [(x, y, 1)]
+        for _ in range(size - 1):
+            row.append(jac_add_affine(row[-1], x, y))
+        rows.append(row)
+        base = jac_add_affine(row[-1], x, y)
+    affine = jac_batch_to_affine([J for row in rows for J in row])
+    return [affine[j:j + size] for j in range(0, len(affine), size)]
+
+def table_mul(table, w, k):
+    k %= n
+    mask = (1 << w) - 1
+    acc = jac_infinity
+    for row in table:
+        digit = k & mask
+        if digit:
+            x, y = row[digit - 1]
+            acc = jac_add_affine(acc, x, y)
+        k >>= w
+    return acc
+
+# Hashing tag_hash + tag_hash fills exactly one SHA256 block, so we keep
+# a hasher that has already absorbed it for each tag, and copy it instead
+# of rehashing the tag every time.
+tag_midstates = {}
+
+def tagged_hasher(tag: str):
+    midstate = tag_midstates.get(tag)
+    if midstate is None:
+        tag_hash = hashlib.sha256(tag.encode()).digest()
+        midstate = hashlib.sha256(tag_hash + tag_hash)
+        tag_midstates[tag] = midstate
+    return midstate.copy()
+
+class Backend:
+    # Everything a backend needs to provide is point(x, y), infinity and
+    # variable_mul(A, k); the remaining operations are implemented here on
+    # top of the pure Python Jacobian arithmetic, and a backend can override
+    # any of them with a faster implementation.
+    #
+    # Points of any backend expose affine coordinates as A.x and A.y, and
+    # the point at infinity has x == y == 0 (which is not on the curve).
+    name = None
+
+    # The table for G is built on first use. Tables for other long-lived
+    # points (the group key and the verification shares) are smaller, since
+    # there can be many of them, and are kept in an LRU cache keyed by
+    # coordinates, which holds at most KEY_TABLE_CACHE_SIZE tables (set with
+    # ROAST_KEY_TABLE_CACHE_SIZE; each takes about 0.18 MB). point_mul uses
+    # a table if there is one.
+    G_WINDOW = 8
+    KEY_WINDOW = 4
+    KEY_TABLE_CACHE_SIZE = int(os.environ.get('ROAST_KEY_TABLE_CACHE_SIZE', 256))
+
+    def __init__(self):
+        self.G = self.point(Gx, Gy)
+        self.G_table = None
+        self.key_tables = OrderedDict()
+        self.key_table_cache_size = self.KEY_TABLE_CACHE_SIZE
+
+    def point(self, x, y):
+        raise NotImplementedError
+
+    def variable_mul(self, A, k):
+        raise NotImplementedError
+
+    def is_infinity(self, A):
+        return A.x == 0 and A.y == 0
+
+    def from_jacobian(self, J):
+        X, Y, Z = J
+        if Z == 0:
+            return self.infinity
+        z_inv = pow(Z, -1, p)
+        z_inv2 = z_inv * z_inv % p
+        return self.point(X * z_inv2 % p, Y * z_inv2 * z_inv % p)
+
+    def point_add(self, A, B):
+        return self.sum_points((A, B))
+
+    def sum_points(self, points):
+        # Adds up all points in Jacobian coordinates, so that only the
+        # result needs a field inversion
+        acc = jac_infinity
+        for A in points:
+            if not (A.x == 0 and A.y == 0):
+                acc = jac_add_affine(acc, A.x, A.y)
+        return self.from_jacobian(acc)
+
+    def point_mul(self, A, k):
+        table = self.key_tables.get((A.x, A.y))
+        if table is None:
+            return self.variable_mul(A, k)
+        self.key_tables.move_to_end((A.x, A.y))
+        return self.from_jacobian(table_mul(table, self.KEY_WINDOW, k))
+
+    def point_mul_G(self, k):
+        if self.G_table is None:
+            self.G_table = build_table(Gx, Gy, self.G_WINDOW)
+        return self.from_jacobian(table_mul(self.G_table, self.G_WINDOW, k))
+
+    def point_mul_G_batch(self, ks):
+        # Same as point_mul_G for each scalar, but normalizes all results
+        # with a single field inversion
+        if self.G_table is None:
+            self.G_table = build_table(Gx, Gy, self.G_WINDOW)
+        Js = [table_mul(self.G_table, self.G_WINDOW, k) for k in ks]
+        finite = [J for J in Js if J[2] != 0]
+        affine = iter(jac_batch_to_affine(finite)) if finite else iter(())
+        return [self.point(*next(affine)) if J[2] != 0 else self.infinity for J in Js]
+
+    def precompute(self, points):
+        # Builds the table for G and for each of the given points, unless
+        # they are already cached. Only the first key_table_cache_size
+        # points get a table: with more keys than that, an LRU would evict
+        # exactly the tables the next call needs first, and every new
+        # CoordinatorModel would rebuild all of them. The remaining points
+        # are multiplied without a table instead.
+        self.point_mul_G(1)
+        points = list(points)[:self.key_table_cache_size]
+        for A in points:
+            key = (A.x, A.y)
+            if key in self.key_tables:
+                self.key_tables.move_to_end(key)
+                continue
+            self.key_tables[key] = build_table(A.x, A.y, self.KEY_WINDOW)
+            if len(self.key_tables) > self.key_table_cache_size:
+                self.key_tables.popitem(last=False)
+
+    def multi_mul(self, pairs):
+        # Computes sum(k * A for A, k in pairs) using Pippenger's bucket
+        # method, which shares the doublings between all points and needs
+        # roughly 256 / c * (len(pairs) + 2^c) additions instead of one full
+        # multiplication per point.
+        points = []
+        scalars = []
+        for A, k in pairs:
+            k %= n
+            if k == 0 or (A.x == 0 and A.y == 0):
+                continue
+            points.append((A.x, A.y))
+            scalars.append(k)
+        if not points:
+            return self.infinity
+
+        c = max(2, len(points).bit_length() - 3)
+        mask = (1 << c) - 1
+        acc = jac_infinity
+        for shift in reversed(range(0, n.bit_length(), c)):
+            for _ in range(c):
+                acc = jac_double(acc)
+            buckets = [None] * mask
+            for (x, y), k in zip(points, scalars):
+                digit = (k >> shift) & mask
+                if digit:
+                    bucket = buckets[digit - 1]
+                    buckets[digit - 1] = (x, y, 1) if bucket is None else jac_add_affine(bucket, x, y)
+            # sum(digit * bucket) = sum of all suffix sums of the buckets
+            running = jac_infinity
+            total = jac_infinity
+            for bucket in reversed(buckets):
+                if bucket is not None:
+                    running = jac_add(running, bucket)
+                total = jac_add(total, running)
+            acc = jac_add(acc, total)
+        return self.from_jacobian(acc)
+
+    def bytes_from_point(self, A) -> bytes:
+        return A.x.to_bytes(32, byteorder="big")
+
+    def point_to_bytes(self, A) -> bytes:
+        # 33-byte compressed encoding, with all zeros for infinity
+        if A.x == 0 and A.y == 0:
+            return bytes(33)
+        return bytes([2 + (A.y & 1)]) + A.x.to_bytes(32, byteorder="big")
+
+    def point_from_bytes(self, b: bytes):
+        if len(b) != 33:
+            raise ValueError('Invalid point encoding length')
+        if not any(b):
+            return self.infinity
+        if b[0] not in (2, 3):
+            raise ValueError('Invalid point encoding prefix')
+        x = int.from_bytes(b[1:], byteorder="big")
+        y2 = (x * x * x + 7) % p
+        y = pow(y2, (p + 1) // 4, p)
+        if x >= p or y * y % p != y2:
+            raise ValueError('Invalid point encoding: not on curve')
+        if y & 1 != b[0] & 1:
+            y = p - y
+        return self.point(x, y)
+
+    def hash_to_scalar(self, tag, *items):
+        hasher = tagged_hasher(tag)
+        for item in items:
+            if isinstance(item, (bytes, bytearray, memoryview)):
+                hasher.update(item)
+            else:
+                hasher.update(item.x.to_bytes(32, byteorder="big"))
+        return int.from_bytes(hasher.digest(), byteorder="big") % n
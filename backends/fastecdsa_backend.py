@@ -0,0 +1,31 @@
+from fastecdsa.curve import secp256k1
+from fastecdsa.point import Point
+
+from backends.base import Backend
+
+class FastecdsaBackend(Backend):
+    # Uses the fastecdsa library for multiplying points that don't have a
+    # precomputed table; everything else goes through the shared Jacobian
+    # arithmetic, which is faster than chaining fastecdsa's affine additions.
+    name = 'fastecdsa'
+    infinity = Point.IDENTITY_ELEMENT
+
+    def point(self, x, y):
+        return Point(x, y, secp256k1)
+
+    def native(self, A):
+        # Serializing / deserializing when sending points
+        # over the network could cause a curve mismatch
+        if getattr(A, 'curve', None) is not secp256k1 and not (A.x == 0 and A.y == 0):
+            A = Point(A.x, A.y, secp256k1)
+        return A
+
+    def point_add(self, A, B):
+        # A single affine addition is cheaper in fastecdsa than going
+        # through Jacobian coordinates, which needs an inversion anyway
+        return self.native(A) + self.native(B)
+
+    def variable_mul(self, A, k):
+        if A.x == 0 and A.y == 0:
+            return self.infinity
+        return self.native(A) * k
@@ -0,0 +1,119 @@
+from backends.base import (
+    Backend, p, n,
+    jac_infinity, jac_double, jac_add_affine, jac_batch_to_affine,
+)
+
+class Point:
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __eq__(self, other):
+        return self.x == other.x and self.y == other.y
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+    def __repr__(self):
+        return f'Point({self.x:#x}, {self.y:#x})'
+
+# secp256k1 has an efficiently computable endomorphism
+#   phi(x, y) = (beta * x, y) = lambda * (x, y)
+# so a scalar k can be split as k = k1 + k2 * lambda with k1 and k2 of about
+# 128 bits each, and k * A = k1 * A + k2 * phi(A) needs half the doublings.
+beta = 0x7AE96A2B657C07106E64479EAC3434E99CF0497512F58995C1396C28719501EE
+lamb = 0x5363AD4CC05C30E0A5261C028812645A122E22EA20816678DF02967C1B23BD72
+
+# Short basis of the lattice {(a, b) : a + b * lambda = 0 mod n}
+a1 = 0x3086D221A7D46BCDE86C90E49284EB15
+b1 = -0xE4437ED6010E88286F547FA90ABFE4C3
+a2 = 0x114CA50F7A8E2F3F657C1108D9D44CFD8
+b2 = a1
+
+def glv_split(k):
+    c1 = (b2 * k + n // 2) // n
+    c2 = (-b1 * k + n // 2) // n
+    k1 = k - c1 * a1 - c2 * a2
+    k2 = -c1 * b1 - c2 * b2
+    return k1, k2
+
+# Width of the windowed non-adjacent form used for the two half-size scalars
+WNAF_WINDOW = 5
+
+def wnaf(k, w):
+    # Digits from least to most significant; every non-zero digit is odd
+    # and less than 2^(w - 1) in absolute value, and is followed by at
+    # least w - 1 zeros.
+    digits = []
+    full = 1 << w
+    half = 1 << (w - 1)
+    while k:
+        if k & 1:
+            digit = k & (full - 1)
+            if digit >= half:
+                digit -= full
+            k -= digit
+        else:
+            digit = 0
+        digits.append(digit)
+        k >>= 1
+    return digits
+
+class PythonBackend(Backend):
+    # Pure Python implementation, which doesn't need any native libraries.
+    # Variable-base multiplication uses the GLV endomorphism together with
+    # interleaved wNAF.
+    name = 'python'
+    infinity = Point(0, 0)
+
+    def point(self, x, y):
+        return Point(x, y)
+
+    def variable_mul(self, A, k):
+        k %= n
+        if k == 0 or (A.x == 0 and A.y == 0):
+            return self.infinity
+
+        k1, k2 = glv_split(k)
+        count = 1 << (WNAF_WINDOW - 2)
+        table1 = self.odd_multiples(A.x, A.y, count)
+        # phi(j * A) = j * phi(A), so the table for phi(A) is free
+        table2 = [(beta * x % p, y) for x, y in table1]
+        if k1 < 0:
+            k1 = -k1
+            table1 = [(x, p - y) for x, y in table1]
+        if k2 < 0:
+            k2 = -k2
+            table2 = [(x, p - y) for x, y in table2]
+
+        naf1 = wnaf(k1, WNAF_WINDOW)
+        naf2 = wnaf(k2, WNAF_WINDOW)
+        naf1 += [0] * (len(naf2) - len(naf1))
+        naf2 += [0] * (len(naf1) - len(naf2))
+
+        acc = jac_infinity
+        for d1, d2 in zip(reversed(naf1), reversed(naf2)):
+            acc = jac_double(acc)
+            if d1 > 0:
+                x, y = table1[d1 >> 1]
+                acc = jac_add_affine(acc, x, y)
+            elif d1 < 0:
+                x, y = table1[-d1 >> 1]
+                acc = jac_add_affine(acc, x, p - y)
+            if d2 > 0:
+                x, y = table2[d2 >> 1]
+                acc = jac_add_affine(acc, x, y)
+            elif d2 < 0:
+                x, y = table2[-d2 >> 1]
+                acc = jac_add_affine(acc, x, p - y)
+        return self.from_jacobian(acc)
+
+    def odd_multiples(self, x, y, count):
+        # Affine coordinates of A, 3A, 5A, ..., (2 * count - 1) * A
+        x2, y2 = jac_batch_to_affine([jac_double((x, y, 1))])[0]
+        Js = [(x, y, 1)]
+        for _ in range(count - 1):
+            Js.append(jac_add_affine(Js[-1], x2, y2))
+        return jac_batch_to_affine(Js)
@@ -1,20 +1,17 @@
-from multiprocessing import Queue
-
 import logging
-import secrets
 import sys
 
-from coordinator import AttackerLevel, AttackerStrategy, Coordinator
-from model import CoordinatorModel
-from shamir import split_secret
+from coordinator import AttackerLevel, AttackerStrategy, make_coordinator
+from model import CoordinatorModel, ShareVerification
+from roast import keygen
 
 import fastec
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
 
-    if len(sys.argv) != 6:
-        print(f'usage: {sys.argv[0]} <host> <start_port> <t> <n> <runs_per_config>')
+    if len(sys.argv) not in (6, 7):
+        print(f'usage: {sys.argv[0]} <host> <start_port> <t> <n> <runs_per_config> [share_verification]')
         sys.exit(1)
 
     host = sys.argv[1]
@@ -22,35 +19,31 @@ if __name__ == '__main__':
     t = int(sys.argv[3])
     n = int(sys.argv[4])
     runs_per_config = int(sys.argv[5])
+    share_verification = ShareVerification(int(sys.argv[6])) if len(sys.argv) == 7 else ShareVerification.EAGER
 
     msg = b""
     i_to_addr = {i + 1: (host, start_port + i) for i in range(n)}
-    i_to_cached_ctx = {i + 1: Queue() for i in range(n)}
 
-    actions = Queue()
-    outgoing = Queue()
-    coordinator = Coordinator(actions, outgoing, i_to_cached_ctx)
-    coordinator.setup(i_to_addr)
-    print(f'Finished establishing connections to {n} participants')
+    i_to_sk, X, i_to_X = keygen(t, n)
+    print(f'Finished keygen for t = {t}, n = {n}')
 
-    # This is insecure; in practice we'd use DKG, but since
-    # key generation is not the focus of the ROAST protocol, we will
-    # keep the implementation simple by having the coordinator
-    # act as a centralized dealer.
-    sk = 1 + secrets.randbelow(fastec.n - 1)
-    i_to_sk = split_secret(sk, t, n)
+    # Build the precomputed tables before the verifier processes are
+    # started, so that they inherit them
+    fastec.precompute([X, *i_to_X.values()])
 
-    X = sk * fastec.G
-    i_to_X = {i: sk_i * fastec.G for i, sk_i in i_to_sk.items()}
-    print(f'Finished keygen for t = {t}, n = {n}')
+    coordinator = make_coordinator(n, share_verification)
+    coordinator.setup(i_to_addr)
+    print(f'Finished establishing connections to {n} participants')
 
     with open(f'roast_{t}_{n}.csv', 'w') as outfile:
         print("t,n,f,attacker_level,elapsed,send_cnt,recv_cnt,success_session_id", file=outfile)
         for f in range(n - t + 1):
             for attacker_level in AttackerLevel:
                 for i in range(runs_per_config):
-                    model = CoordinatorModel(X, i_to_X, t, n, msg)
+                    model = CoordinatorModel(X, i_to_X, t, n, msg, share_verification)
                     attacker_strategy = AttackerStrategy(attacker_level, n, f)
                     elapsed, send_count, recv_count, sid = coordinator.run(i_to_sk, model, attacker_strategy)
                     print(t, n, f, attacker_level, elapsed, send_count, recv_count, sid, sep=',', file=outfile)
                     print(f'Finished run {i + 1} of {runs_per_config} for config: (t = {t}, n = {n}, f = {f}, attacker_level = {attacker_level})')
+
+    coordinator.close()
@@ -0,0 +1,157 @@
+import json
+import os
+import pickle
+import platform
+import secrets
+import statistics
+import sys
+import time
+
+# Run from anywhere: the ROAST modules are two directories up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from roast import (
+    H, keygen, pre_round, pre_agg, session_context, share_val, share_val_batch,
+    sign_round, sign_agg, verify,
+)
+from shamir import lagrange, lagrange_all
+from transport import decode, encode_binary
+
+import fastec
+
+# Times each cryptographic primitive of ROAST, and the encoding of protocol
+# messages, for sessions of each of the given sizes t. Primitives whose cost
+# doesn't depend on t are only timed once, with t = null in the results.
+DEFAULT_TS = (3, 11, 34, 67)
+# Each primitive is called often enough to take at least MIN_TIME seconds,
+# REPEAT times. compare uses the fastest of the repeats, which is the least
+# affected by other load on the machine
+MIN_TIME = 0.05
+REPEAT = 5
+# Slowdown that compare reports as a regression
+DEFAULT_TOLERANCE = 0.25
+
+def time_op(f):
+    # Per-call times (in seconds) of REPEAT rounds, like timeit.autorange
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            f()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_TIME:
+            break
+        calls *= 2 if elapsed * 10 >= MIN_TIME else 10
+    times = [elapsed / calls]
+    for _ in range(REPEAT - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            f()
+        times.append((time.perf_counter() - start) / calls)
+    return calls, times
+
+def session_ops(t, with_fixed):
+    # (name, depends on t, f) for a session of t out of t participants
+    msg = secrets.token_bytes(32)
+    i_to_sk, X, i_to_X = keygen(t, t)
+    fastec.precompute([X, *i_to_X.values()])
+    T = tuple(range(1, t + 1))
+    i_to_nonce = {i: pre_round() for i in T}
+    i_to_pre = {i: pre_i for i, (_, pre_i) in i_to_nonce.items()}
+    pre = pre_agg(i_to_pre, T)
+    ctx = session_context(X, i_to_X, msg, T, pre)
+    i_to_s = {i: sign_round(X, msg, T, pre, i, i_to_sk[i], i_to_nonce[i][0]) for i in T}
+    sig = sign_agg(ctx, i_to_s)
+    assert verify(ctx, sig)
+    ctx_1 = ctx._replace(pre_i=i_to_pre[1])
+    D, E = pre
+
+    ops = [
+        ('H', False, lambda: H('non', X, msg, D, E)),
+        ('pre_round', False, pre_round),
+        ('pre_agg', True, lambda: pre_agg(i_to_pre, T)),
+        ('session_context', True, lambda: session_context(X, i_to_X, msg, T, pre)),
+        ('share_val', False, lambda: share_val(ctx_1, 1, i_to_s[1])),
+        ('share_val_batch', True, lambda: share_val_batch(ctx, i_to_pre, i_to_s)),
+        ('sign_round', True, lambda: sign_round(X, msg, T, pre, 1, i_to_sk[1], i_to_nonce[1][0])),
+        ('sign_agg', True, lambda: sign_agg(ctx, i_to_s)),
+        ('verify', False, lambda: verify(ctx, sig)),
+        ('lagrange', True, lambda: lagrange(T, 1)),
+        ('lagrange_all', True, lambda: lagrange_all(T)),
+    ]
+    messages = [
+        ('SIGN', True, (1, (msg, set(T), pre, False))),
+        ('SHARE', False, (1, (1, i_to_s[1], i_to_pre[1]))),
+    ]
+    # What transport.encode does for each wire format
+    fmt_to_encode = {'pickle': pickle.dumps, 'binary': encode_binary}
+    for name, depends_on_t, obj in messages:
+        for fmt, encode in fmt_to_encode.items():
+            data = encode(obj)
+            ops.append((f'encode {name} ({fmt})', depends_on_t, lambda encode=encode, obj=obj: encode(obj)))
+            ops.append((f'decode {name} ({fmt})', depends_on_t, lambda data=data: decode(data)))
+    return [op for op in ops if op[1] or with_fixed]
+
+def run(ts):
+    results = []
+    for k, t in enumerate(ts):
+        for name, depends_on_t, f in session_ops(t, with_fixed=k == 0):
+            calls, times = time_op(f)
+            result = {
+                'op': name,
+                't': t if depends_on_t else None,
+                'calls': calls,
+                'median': statistics.median(times),
+                'min': min(times),
+            }
+            results.append(result)
+            print(f'{name:24} t = {str(result["t"]):>4}  {result["median"] * 1e6:12.2f} us')
+    return {
+        'backend': fastec.backend.name,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+def compare(baseline, current, tolerance):
+    # Prints the change of every primitive in both files, and returns the
+    # regressions: those that got slower by more than tolerance
+    if baseline['backend'] != current['backend']:
+        print(f'Warning: comparing backend {current["backend"]} against {baseline["backend"]}')
+    key_to_baseline = {(r['op'], r['t']): r for r in baseline['results']}
+    regressions = []
+    for r in current['results']:
+        b = key_to_baseline.get((r['op'], r['t']))
+        if b is None:
+            continue
+        ratio = r['min'] / b['min']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = 'REGRESSION'
+            regressions.append((r['op'], r['t'], ratio))
+        elif ratio < 1 / (1 + tolerance):
+            flag = 'improved'
+        print(f'{r["op"]:24} t = {str(r["t"]):>4}  {b["min"] * 1e6:12.2f} us -> {r["min"] * 1e6:12.2f} us  {ratio:6.2f}x  {flag}')
+    return regressions
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'run' and len(sys.argv) <= 4:
+        ts = [int(t) for t in sys.argv[3].split(',')] if len(sys.argv) == 4 else DEFAULT_TS
+        with open(sys.argv[2], 'w') as outfile:
+            json.dump(run(ts), outfile, indent=1)
+    elif len(sys.argv) in (4, 5) and sys.argv[1] == 'compare':
+        with open(sys.argv[2]) as infile:
+            baseline = json.load(infile)
+        with open(sys.argv[3]) as infile:
+            current = json.load(infile)
+        tolerance = float(sys.argv[4]) if len(sys.argv) == 5 else DEFAULT_TOLERANCE
+        regressions = compare(baseline, current, tolerance)
+        if regressions:
+            print(f'{len(regressions)} regressions of more than {tolerance:.0%}')
+            sys.exit(1)
+    else:
+        print(f'usage: {sys.argv[0]} run <output.json> [t,...]')
+        print(f'       {sys.argv[0]} compare <baseline.json> <current.json> [tolerance]')
+        sys.exit(1)
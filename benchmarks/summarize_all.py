@@ -0,0 +1,171 @@
+from collections import defaultdict
+from fnmatch import fnmatch
+from itertools import islice
+
+import csv
+import json
+import math
+import os
+import statistics
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Summarizes every roast_*.csv file below a directory (the output of
+# bench_all.py, sweep.py and simulate.py, and the older v1 format without
+# attacker levels), with one row per (file, t, n, attacker_level, f) and
+# metric. Files are read in chunks of CHUNK_ROWS rows, which are aggregated
+# with NumPy if it is installed. Summaries are cached per file, keyed on its
+# modification time and size, so only new or changed files are read again.
+CHUNK_ROWS = 1 << 16
+METRICS = ('elapsed', 'ec_elapsed', 'send_cnt', 'recv_cnt', 'success_session_id')
+PERCENTILES = (50, 95, 99)
+OUTPUT_COLUMNS = ['file', 't', 'n', 'attacker_level', 'f', 'metric', 'count', 'mean', 'std',
+                  *(f'p{q}' for q in PERCENTILES), 'ci95_low', 'ci95_high']
+
+# Two-sided 95% critical values of Student's t distribution for 1 to 30
+# degrees of freedom; beyond that, the normal distribution's 1.96 is close
+T_CRITICAL = (
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+)
+
+def discover(root):
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        paths.extend(os.path.join(dirpath, name) for name in sorted(filenames) if fnmatch(name, 'roast_*.csv'))
+    return paths
+
+def read_groups(path):
+    # Maps (t, n, attacker_level, f) to the values of each metric in the
+    # file, as lists or NumPy arrays
+    with open(path, newline='') as infile:
+        reader = csv.reader(infile)
+        header = next(reader, None)
+        if header is None:
+            return {}
+        col = {name: k for k, name in enumerate(header)}
+        metrics = [m for m in METRICS if m in col]
+        level_col = col.get('attacker_level')
+        key_cols = [col['t'], col['n'], col['f']]
+        metric_cols = [col[m] for m in metrics]
+
+        key_to_parts = defaultdict(lambda: defaultdict(list))
+        while True:
+            rows = list(islice(reader, CHUNK_ROWS))
+            if not rows:
+                break
+            if np is None:
+                for row in rows:
+                    t, n, f = (int(row[k]) for k in key_cols)
+                    level = row[level_col].rsplit('.', 1)[-1] if level_col is not None else ''
+                    parts = key_to_parts[t, n, level, f]
+                    for m, k in zip(metrics, metric_cols):
+                        parts[m].append(float(row[k]))
+                continue
+
+            # Number the keys of the chunk with a single mixed-radix integer,
+            # sort by it once, and split each metric column at the key
+            # boundaries
+            columns = list(zip(*rows))
+            if level_col is not None:
+                level_to_code = {}
+                codes = [level_to_code.setdefault(level, len(level_to_code)) for level in columns[level_col]]
+                level_names = [level.rsplit('.', 1)[-1] for level in level_to_code]
+            else:
+                codes = [0] * len(rows)
+                level_names = ['']
+            key_columns = [np.fromiter(map(int, columns[k]), np.int64, len(rows)) for k in key_cols]
+            key_columns.append(np.array(codes, dtype=np.int64))
+            key = np.zeros(len(rows), dtype=np.int64)
+            radixes = [int(column.max()) + 1 for column in key_columns]
+            for column, radix in zip(key_columns, radixes):
+                key = key * radix + column
+            order = np.argsort(key, kind='stable')
+            unique_keys, starts = np.unique(key[order], return_index=True)
+            values = np.column_stack([np.fromiter(map(float, columns[k]), np.float64, len(rows)) for k in metric_cols])[order]
+            for packed, group in zip(unique_keys.tolist(), np.split(values, starts[1:])):
+                parts = []
+                for radix in reversed(radixes):
+                    packed, digit = divmod(packed, radix)
+                    parts.append(digit)
+                level_code, f, n, t = parts
+                group_parts = key_to_parts[t, n, level_names[level_code], f]
+                for j, m in enumerate(metrics):
+                    group_parts[m].append(group[:, j])
+
+    if np is not None:
+        return {key: {m: np.concatenate(arrays) for m, arrays in parts.items()} for key, parts in key_to_parts.items()}
+    return key_to_parts
+
+def percentile(sorted_values, q):
+    # Linear interpolation between the closest ranks, like numpy.percentile
+    pos = (len(sorted_values) - 1) * q / 100
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+def describe(values):
+    count = len(values)
+    if np is not None:
+        mean = float(np.mean(values))
+        std = float(np.std(values, ddof=1)) if count > 1 else 0.0
+        quantiles = [float(x) for x in np.percentile(values, PERCENTILES)]
+    else:
+        mean = statistics.fmean(values)
+        std = statistics.stdev(values) if count > 1 else 0.0
+        values = sorted(values)
+        quantiles = [percentile(values, q) for q in PERCENTILES]
+    # Confidence interval of the mean
+    t_crit = T_CRITICAL[count - 2] if 1 < count <= len(T_CRITICAL) + 1 else 1.96
+    margin = t_crit * std / math.sqrt(count)
+    return [count, mean, std, *quantiles, mean - margin, mean + margin]
+
+def summarize_file(path):
+    rows = []
+    for (t, n, level, f), metric_to_values in sorted(read_groups(path).items()):
+        for m in METRICS:
+            if m in metric_to_values:
+                rows.append([path, t, n, level, f, m, *describe(metric_to_values[m])])
+    return rows
+
+def summarize(root, output):
+    cache_path = os.path.splitext(output)[0] + '_cache.json'
+    try:
+        with open(cache_path) as infile:
+            cache = json.load(infile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+
+    new_cache = {}
+    for path in discover(root):
+        st = os.stat(path)
+        entry = cache.get(path)
+        if entry is not None and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            print(f'{path}: cached')
+        else:
+            entry = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'rows': summarize_file(path)}
+            print(f'{path}: {len(entry["rows"])} summary rows')
+        new_cache[path] = entry
+
+    with open(output, 'w', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(OUTPUT_COLUMNS)
+        for entry in new_cache.values():
+            writer.writerows(entry['rows'])
+    with open(cache_path, 'w') as outfile:
+        json.dump(new_cache, outfile)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        print(f'usage: {sys.argv[0]} [root] [output]')
+        sys.exit(1)
+
+    root = sys.argv[1] if len(sys.argv) > 1 else '.'
+    output = sys.argv[2] if len(sys.argv) > 2 else 'summary.csv'
+    summarize(root, output)
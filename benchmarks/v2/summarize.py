@@ -39,8 +39,12 @@ def generate_data(t, n):
             print('frac\telapsed', file=outfile)
             for f in range(0, n - t + 1):
                 key = (level, f)
+                if not counts[key]:
+                    continue
                 avg = sums[key] / counts[key]
-                print(f'{f / (n - t):.6f}\t{avg:.12f}', file=outfile)
+                # With n == t, f can only be 0
+                frac = f / (n - t) if n > t else 0.0
+                print(f'{frac:.6f}\t{avg:.12f}', file=outfile)
 
 if __name__ == '__main__':
     for t, n in [(3, 5), (11, 15), (34, 50), (67, 100)]:
@@ -1,25 +1,95 @@
+from collections import defaultdict, deque
 from dataclasses import dataclass, field
 from multiprocessing import Process, Queue, Value
+from queue import Empty, SimpleQueue
+from threading import Thread
 from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, IPPROTO_TCP, TCP_NODELAY
 from typing import Any
 from enum import Enum
 
+import heapq
 import logging
+import os
 import secrets
 import sys
 import time
 
-from shamir import split_secret
-from model import ActionType, CoordinatorModel
-from roast import share_val, verify
-from transport import send_obj, recv_obj
+from async_coordinator import AsyncCoordinator
+from model import ActionType, CoordinatorModel, ShareVerification
+from roast import keygen, share_val, verify
+from session_table import SessionTable
+from tracing import make_tracer, timed
+from transport import encode_frame, encode_sign_frames, recv_obj
 
 import fastec
 
 @dataclass(order=True)
 class PriorityAction:
     priority: int
-    action: Any=field(compare=False)
+    # Assigned by the ActionScheduler, to keep arrival order within a priority
+    seq: int=0
+    action: Any=field(default=None, compare=False)
+    queued_at: float=field(default_factory=time.monotonic, compare=False)
+
+@dataclass
+class WaitStats:
+    count: int=0
+    total_wait: float=0.0
+    max_wait: float=0.0
+
+class ActionScheduler:
+    # Actions arrive from the receiving processes through a multiprocessing
+    # queue, and from the main loop itself. get() first moves everything that
+    # has arrived onto a heap, so that the most urgent action according to
+    # ActionType is handled next, in arrival order within the same priority.
+    def __init__(self, queue):
+        self.queue = queue
+        self.heap = []
+        self.seq = 0
+        # RunTrace of the current run, if tracing is on
+        self.trace = None
+        self.clear()
+
+    def clear(self):
+        # Resets the stats, and drops actions the main loop queued during a
+        # previous run (incoming messages are still filtered by run_id)
+        self.heap.clear()
+        self.max_depth = 0
+        self.type_to_stats = defaultdict(WaitStats)
+
+    def put(self, action):
+        self.seq += 1
+        action.seq = self.seq
+        heapq.heappush(self.heap, action)
+        self.max_depth = max(self.max_depth, len(self.heap))
+
+    def get(self):
+        while True:
+            try:
+                self.put(self.queue.get_nowait())
+            except Empty:
+                break
+        if not self.heap:
+            self.put(self.queue.get())
+
+        action = heapq.heappop(self.heap)
+        wait = time.monotonic() - action.queued_at
+        stats = self.type_to_stats[action.action[0]]
+        stats.count += 1
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        if self.trace is not None:
+            self.trace.record(f'queue_wait:{action.action[0].name}', wait)
+        return action.action
+
+    def depth(self):
+        return len(self.heap)
+
+    def summary(self):
+        parts = [f'max_depth = {self.max_depth}']
+        for action_type, stats in sorted(self.type_to_stats.items(), key=lambda item: item[0].value):
+            parts.append(f'{action_type.name}: count = {stats.count}, mean_wait = {stats.total_wait / stats.count:.6f}, max_wait = {stats.max_wait:.6f}')
+        return '; '.join(parts)
 
 class AttackerLevel(Enum):
     # Set of malicious participants determined in the beginning
@@ -53,43 +123,76 @@ class AttackerStrategy:
             raise ValueError('Unexpected AttackerLevel:', self.level)
 
 class Coordinator:
-    def __init__(self, actions, outgoing, i_to_cached_ctx):
+    def __init__(self, actions, session_table, share_verification=ShareVerification.EAGER):
         self.actions = actions
-        self.outgoing = outgoing
-        self.i_to_cached_ctx = i_to_cached_ctx
+        self.scheduler = ActionScheduler(actions)
+        # One queue of serialized frames per connection, each drained by its
+        # own writer thread so that a slow socket doesn't hold up the others
+        self.outgoing = {}
+        self.writers = []
+        self.session_table = session_table
+        self.share_verification = share_verification
         self.connections = {}
         self.run_id = Value('i', 0)
+        # Nonce commitments uploaded by participants with NONCES messages,
+        # which outlive runs; the receiving processes pass them on through
+        # uploads, and they are picked up when the next run starts
+        self.uploads = Queue()
+        self.i_to_nonces = defaultdict(deque)
+        # With tracing on (see tracing.py), trace holds the RunTrace of the
+        # latest run
+        self.tracer = make_tracer()
+        self.trace = None
 
     def queue_action(self, action_type, data):
-        self.actions.put(PriorityAction(action_type.value, (action_type, data)))
+        self.actions.put(PriorityAction(action_type.value, action=(action_type, data)))
 
-    def queue_incoming_loop(self, sock, cached_ctx_queue):
+    def schedule_action(self, action_type, data):
+        # Same as queue_action, for actions produced by the main loop
+        self.scheduler.put(PriorityAction(action_type.value, action=(action_type, data)))
+
+    def queue_incoming_loop(self, sock):
         while True:
             obj = recv_obj(sock)
             if not obj:
                 break
+            # Timestamps for tracing are cheap compared to receiving a
+            # message, so they are always taken
+            received_at = time.monotonic()
             run_id, (i, s_i, pre_i) = obj
+            if type(pre_i) is list:
+                self.uploads.put((i, pre_i))
+                continue
             share_is_valid = False
-            if s_i is not None:
-                ctx_run_id, ctx = cached_ctx_queue.get()
-                # Discard queue items from previous runs
-                while ctx_run_id != run_id:
-                    ctx_run_id, ctx = cached_ctx_queue.get()
-                share_is_valid = share_val(ctx, i, s_i)
-            data = run_id, i, s_i, pre_i, share_is_valid
+            share_val_time = None
+            if s_i is not None and self.share_verification == ShareVerification.EAGER:
+                ctx = self.session_table.lookup(run_id, i)
+                # If the session has been dropped from the table, the main
+                # loop checks the share instead
+                if ctx is None:
+                    share_is_valid = None
+                else:
+                    start = time.perf_counter()
+                    share_is_valid = share_val(ctx, i, s_i)
+                    share_val_time = time.perf_counter() - start
+            data = run_id, i, s_i, pre_i, share_is_valid, received_at, share_val_time
             self.queue_action(ActionType.INCOMING, data)
 
-    def send_outgoing_loop(self):
+    def send_outgoing_loop(self, i):
         while True:
-            i, run_id, data = self.outgoing.get()
-            assert i in self.connections
+            item = self.outgoing[i].get()
+            if item is None:
+                break
+            run_id, frame = item
             with self.run_id.get_lock():
-                if run_id < self.run_id.value:
+                # run_id is None for messages that have to be sent even
+                # after their run is over
+                if run_id is not None and run_id < self.run_id.value:
                     # The main thread is at least in run self.run_id.value,
                     # so it's safe to drop messages from earlier runs.
                     logging.debug(f'Ignoring outgoing message from previous run (message run_id = {run_id}, my run_id = {self.run_id.value})')
                     continue
-            send_obj(self.connections[i], (run_id, data))
+            self.connections[i].sendall(frame)
 
     def setup(self, i_to_addr):
         for i, addr_i in i_to_addr.items():
@@ -99,9 +202,26 @@ class Coordinator:
             self.connections[i].connect(addr_i)
             logging.debug(f'Established connection to participant {i} at {addr_i}')
 
-        Process(target=self.send_outgoing_loop, daemon=True).start()
         for i in self.connections.keys():
-            Process(target=self.queue_incoming_loop, args=[self.connections[i], self.i_to_cached_ctx[i]], daemon=True).start()
+            Process(target=self.queue_incoming_loop, args=[self.connections[i]], daemon=True).start()
+        # Writer threads are only started after forking the receiving processes
+        for i in self.connections.keys():
+            self.outgoing[i] = SimpleQueue()
+            writer = Thread(target=self.send_outgoing_loop, args=[i], daemon=True)
+            writer.start()
+            self.writers.append(writer)
+
+    def close(self):
+        # Lets the writers finish sending before closing the connections;
+        # the daemon processes exit together with the main process
+        for outgoing in self.outgoing.values():
+            outgoing.put(None)
+        for writer in self.writers:
+            writer.join()
+        for connection in self.connections.values():
+            connection.close()
+        if self.tracer is not None:
+            self.tracer.close()
 
     def run(self, i_to_sk, model, attacker_strategy):
         with self.run_id.get_lock():
@@ -110,15 +230,47 @@ class Coordinator:
 
         send_count = 0
         recv_count = 0
+        self.scheduler.clear()
+        self.session_table.clear()
+
+        while True:
+            try:
+                i, nonces = self.uploads.get_nowait()
+            except Empty:
+                break
+            self.i_to_nonces[i].extend(nonces)
+
+        trace = None
+        if self.tracer is not None:
+            trace = self.tracer.start_run(run_id)
+            # When each participant was last sent a message it will answer
+            i_to_sent_at = {}
+        self.trace = self.scheduler.trace = model.trace = trace
 
         send_count += len(i_to_sk)
+        i_to_pre = {}
         for i, sk_i in i_to_sk.items():
-            self.outgoing.put((i, run_id, (model.X, i, sk_i)))
+            if self.i_to_nonces[i]:
+                # Use an uploaded nonce instead of waiting for pre_i. The
+                # participant only forgets the nonce when it receives this
+                # INIT, so it must not be dropped even if the run is over by
+                # the time it is sent.
+                nonce_id, i_to_pre[i] = self.i_to_nonces[i].popleft()
+                frame = timed(trace, 'serialize', encode_frame, (run_id, (model.X, i, sk_i, nonce_id)))
+                self.outgoing[i].put((None, frame))
+            else:
+                frame = timed(trace, 'serialize', encode_frame, (run_id, (model.X, i, sk_i)))
+                if trace is not None:
+                    i_to_sent_at[i] = time.monotonic()
+                self.outgoing[i].put((run_id, frame))
 
         start = time.time()
 
+        for i, pre_i in i_to_pre.items():
+            self.schedule_action(*timed(trace, 'handle_incoming', model.handle_incoming, i, None, pre_i, True))
+
         while True:
-            action_type, data = self.actions.get().action
+            action_type, data = self.scheduler.get()
 
             if action_type == ActionType.NO_OP:
                 pass
@@ -126,7 +278,7 @@ class Coordinator:
             elif action_type == ActionType.INCOMING:
                 recv_count += 1
 
-                msg_run_id, i, s_i, pre_i, share_is_valid = data
+                msg_run_id, i, s_i, pre_i, share_is_valid, received_at, share_val_time = data
                 # Ignore incoming messages from wrong run_id
                 if msg_run_id < run_id:
                     logging.debug(f'Ignoring incoming message from previous run (message run_id = {msg_run_id}, my run_id = {run_id})')
@@ -138,36 +290,58 @@ class Coordinator:
                     logging.debug(f'Initial incoming message from participant {i}')
                 else:
                     logging.debug(f'Incoming message from participant {i} in session {model.i_to_sid[i]}')
-                action_type, data = model.handle_incoming(i, s_i, pre_i, share_is_valid)
-                self.queue_action(action_type, data)
+                if trace is not None:
+                    sent_at = i_to_sent_at.pop(i, None)
+                    if sent_at is not None:
+                        trace.record('init_round_trip' if s_i is None else 'round_trip', received_at - sent_at, i=i)
+                    if share_val_time is not None:
+                        trace.record('share_val', share_val_time, i=i)
+                if share_is_valid is None and i in model.i_to_sid and i not in model.malicious:
+                    share_is_valid = timed(trace, 'share_val', share_val, model.share_context(i), i, s_i, i=i)
+                action_type, data = timed(trace, 'handle_incoming', model.handle_incoming, i, s_i, pre_i, share_is_valid)
+                self.schedule_action(action_type, data)
 
             elif action_type == ActionType.SESSION_START:
-                send_count += len(data)
-
-                sid_ctr = model.sid_ctr
-                logging.debug(f'Enough participants are ready, starting new session with sid {sid_ctr}')
-                T = model.sid_to_T[sid_ctr]
-                session_malicious = attacker_strategy.choose_malicious(T, sid_ctr)
-
-                for item in data:
-                    ctx, i = item
-                    self.i_to_cached_ctx[i].put((run_id, ctx))
-                    self.outgoing.put((i, run_id, (ctx.msg, ctx.T, ctx.pre, i in session_malicious)))
+                sid, ctx, i_to_pre = data
+                send_count += len(ctx.T)
+
+                logging.debug(f'Enough participants are ready, starting new session with sid {sid}')
+                session_malicious = attacker_strategy.choose_malicious(ctx.T, sid)
+
+                if self.share_verification == ShareVerification.EAGER:
+                    self.session_table.add(run_id, sid, ctx, i_to_pre)
+                frames = timed(trace, 'serialize', encode_sign_frames, run_id, ctx.msg, ctx.T, ctx.pre, sid=sid)
+                if trace is not None:
+                    sent_at = time.monotonic()
+                    for i in ctx.T:
+                        i_to_sent_at[i] = sent_at
+                for i in ctx.T:
+                    self.outgoing[i].put((run_id, frames[i in session_malicious]))
 
             elif action_type == ActionType.SESSION_SUCCESS:
                 ctx, sig, sid = data
                 end = time.time()
+                logging.debug(f'Action queue stats: {self.scheduler.summary()}')
+                if trace is not None:
+                    self.tracer.end_run(trace)
+                    logging.info(f'Trace of run {run_id}: {trace.summary()}')
                 assert verify(ctx, sig)
                 return end - start, send_count, recv_count, sid
 
             else:
                 raise Exception('Unknown ActionType', action_type)
 
+def make_coordinator(n, share_verification):
+    # ROAST_COORDINATOR=async selects the single-process asyncio coordinator
+    if os.environ.get('ROAST_COORDINATOR') == 'async':
+        return AsyncCoordinator(share_verification)
+    return Coordinator(Queue(), SessionTable(n), share_verification)
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
 
-    if len(sys.argv) != 8:
-        print(f'usage: {sys.argv[0]} <host> <start_port> <threshold> <total> <malicious> <attacker_level> <runs>')
+    if len(sys.argv) not in (8, 9):
+        print(f'usage: {sys.argv[0]} <host> <start_port> <threshold> <total> <malicious> <attacker_level> <runs> [share_verification]')
         sys.exit(1)
 
     host = sys.argv[1]
@@ -177,28 +351,24 @@ if __name__ == '__main__':
     m = int(sys.argv[5])
     attacker_level = AttackerLevel(int(sys.argv[6]))
     runs = int(sys.argv[7])
+    share_verification = ShareVerification(int(sys.argv[8])) if len(sys.argv) == 9 else ShareVerification.EAGER
 
     msg = b""
     i_to_addr = {i + 1: (host, start_port + i) for i in range(n)}
 
-    # This is insecure; in practice we'd use DKG, but since
-    # key generation is not the focus of the ROAST protocol, we will
-    # keep the implementation simple by having the coordinator
-    # act as a centralized dealer.
-    sk = 1 + secrets.randbelow(fastec.n - 1)
-    i_to_sk = split_secret(sk, t, n)
+    i_to_sk, X, i_to_X = keygen(t, n)
 
-    X = sk * fastec.G
-    i_to_X = {i: sk_i * fastec.G for i, sk_i in i_to_sk.items()}
-    i_to_cached_ctx = {i + 1: Queue() for i in range(n)}
+    # Build the precomputed tables before the verifier processes are
+    # started, so that they inherit them
+    fastec.precompute([X, *i_to_X.values()])
 
-    actions = Queue()
-    outgoing = Queue()
-    coordinator = Coordinator(actions, outgoing, i_to_cached_ctx)
+    coordinator = make_coordinator(n, share_verification)
     coordinator.setup(i_to_addr)
 
     for _ in range(runs):
-        model = CoordinatorModel(X, i_to_X, t, n, msg)
+        model = CoordinatorModel(X, i_to_X, t, n, msg, share_verification)
         attacker_strategy = AttackerStrategy(attacker_level, n, m)
         elapsed, send_count, recv_count, sid = coordinator.run(i_to_sk, model, attacker_strategy)
         print(t, n, m, attacker_level, elapsed, send_count, recv_count, sid, sep=',')
+
+    coordinator.close()
@@ -1,27 +1,180 @@
-from fastecdsa.curve import secp256k1
-from fastecdsa.point import Point
+import os
+import secrets
+import sys
+import time
 
-G = secp256k1.G
-n = secp256k1.q
-infinity = Point.IDENTITY_ELEMENT
+from backends import BACKENDS, load_backend
+from backends.base import n
+
+# All elliptic curve operations go through the selected backend, which can be
+# chosen with the ROAST_EC_BACKEND environment variable or set_backend().
+# Points are only compatible within a backend, so the backend should be
+# selected before any points are created.
+DEFAULT_BACKEND = 'fastecdsa'
+
+backend = None
+G = None
+infinity = None
+
+def set_backend(name):
+    global backend, G, infinity
+    backend = load_backend(name)
+    G = backend.G
+    infinity = backend.infinity
+
+set_backend(os.environ.get('ROAST_EC_BACKEND', DEFAULT_BACKEND))
+
+def point(x, y):
+    return backend.point(x, y)
+
+def generator():
+    return backend.G
+
+def is_infinity(A):
+    return backend.is_infinity(A)
 
 def point_add(A, B):
-    # Serializing / deserializing when sending points
-    # over the network could cause a curve mismatch
-    if A != infinity:
-        A = Point(A.x, A.y, secp256k1)
-    if B != infinity:
-        B = Point(B.x, B.y, secp256k1)
-    return A + B
+    return backend.point_add(A, B)
+
+def sum_points(points):
+    return backend.sum_points(points)
 
 def point_mul(A, k):
-    return A * k
+    return backend.point_mul(A, k)
+
+def point_mul_G(k):
+    return backend.point_mul_G(k)
+
+def point_mul_G_batch(ks):
+    return backend.point_mul_G_batch(ks)
+
+def multi_mul(pairs):
+    return backend.multi_mul(pairs)
+
+def precompute(points):
+    return backend.precompute(points)
+
+def bytes_from_point(P) -> bytes:
+    return backend.bytes_from_point(P)
+
+def point_to_bytes(P) -> bytes:
+    return backend.point_to_bytes(P)
+
+def point_from_bytes(b: bytes):
+    return backend.point_from_bytes(b)
+
+def point_to_affine_bytes(P) -> bytes:
+    # 64-byte uncompressed encoding without a prefix, for points that are
+    # only passed between our own processes and so are not validated
+    return P.x.to_bytes(32, byteorder="big") + P.y.to_bytes(32, byteorder="big")
+
+def point_from_affine_bytes(b: bytes):
+    return backend.point(int.from_bytes(b[:32], byteorder="big"), int.from_bytes(b[32:], byteorder="big"))
+
+def hash_to_scalar(tag, *items):
+    return backend.hash_to_scalar(tag, *items)
 
 def bytes_from_int(x: int) -> bytes:
     return x.to_bytes(32, byteorder="big")
 
-def bytes_from_point(P: Point) -> bytes:
-    return bytes_from_int(P.x)
-
 def int_from_bytes(b: bytes) -> int:
     return int.from_bytes(b, byteorder="big")
+
+def bench_backends(t, runs):
+    # Compares the backends on the operations that ROAST uses, with a
+    # session of t participants where relevant
+    results = {}
+    for name in BACKENDS:
+        try:
+            b = load_backend(name)
+        except ImportError as e:
+            print(f'Skipping backend {name}: {e}')
+            continue
+
+        scalars = [1 + secrets.randbelow(n - 1) for _ in range(3 * t + 1)]
+        points = [b.point_mul_G(k) for k in scalars]
+        key = points[0]
+        b.precompute([key])
+        fresh = points[1]
+        encoded = b.point_to_bytes(fresh)
+        msg = secrets.token_bytes(32)
+
+        ops = [
+            ('point_add', lambda: b.point_add(points[1], points[2])),
+            (f'sum_points ({t})', lambda: b.sum_points(points[:t])),
+            ('point_mul', lambda: b.point_mul(fresh, scalars[0])),
+            ('point_mul (cached key)', lambda: b.point_mul(key, scalars[0])),
+            ('point_mul_G', lambda: b.point_mul_G(scalars[0])),
+            (f'point_mul_G_batch ({t})', lambda: b.point_mul_G_batch(scalars[:t])),
+            (f'multi_mul ({3 * t + 1})', lambda: b.multi_mul(zip(points, scalars))),
+            ('point_to_bytes', lambda: b.point_to_bytes(fresh)),
+            ('point_from_bytes', lambda: b.point_from_bytes(encoded)),
+            ('hash_to_scalar', lambda: b.hash_to_scalar('non', key, msg, fresh, fresh)),
+        ]
+        for op, f in ops:
+            start = time.perf_counter()
+            for _ in range(runs):
+                f()
+            results[op, name] = (time.perf_counter() - start) / runs
+
+    names = [name for name in BACKENDS if any(key[1] == name for key in results)]
+    print('operation'.ljust(28) + ''.join(name.rjust(14) for name in names))
+    for op in dict.fromkeys(op for op, _ in results):
+        row = op.ljust(28)
+        for name in names:
+            row += f'{results[op, name] * 1e6:11.1f} us'
+        print(row)
+
+def test_backends(count=20):
+    # Every backend that can be loaded has to give the same points (compared
+    # by coordinates, since each backend has its own point type)
+    def xy(A):
+        return (A.x, A.y)
+
+    name_to_backend = {}
+    for name in BACKENDS:
+        try:
+            name_to_backend[name] = load_backend(name)
+        except ImportError as e:
+            print(f'Skipping backend {name}: {e}')
+    for _ in range(count):
+        k1, k2, k3 = (1 + secrets.randbelow(n - 1) for _ in range(3))
+        results = []
+        for b in name_to_backend.values():
+            P, Q = b.point_mul_G(k1), b.point_mul_G(k2)
+            minus_P = b.point_mul_G(n - k1)
+            b.precompute([Q])
+            # With and without a precomputed table
+            assert xy(b.point_mul(P, k3)) == xy(b.point_mul(Q, k1 * k3 * pow(k2, -1, n) % n))
+            assert b.is_infinity(b.sum_points([P, minus_P]))
+            assert b.is_infinity(b.point_add(P, minus_P))
+            assert xy(b.sum_points([P, P])) == xy(b.point_mul_G(2 * k1))
+            assert b.is_infinity(b.multi_mul([(P, k3), (minus_P, k3)]))
+            for A in (P, Q, b.infinity):
+                assert xy(b.point_from_bytes(b.point_to_bytes(A))) == xy(A)
+            # Messages can be any bytes-like object
+            msg = secrets.token_bytes(32)
+            h = b.hash_to_scalar('non', P, msg, Q)
+            assert b.hash_to_scalar('non', P, bytearray(msg), Q) == h
+            assert b.hash_to_scalar('non', P, memoryview(msg), Q) == h
+            results.append([xy(A) for A in (
+                P,
+                b.point_mul(P, k3),
+                b.point_mul(Q, k3),
+                b.multi_mul([(P, k2), (Q, k3), (b.G, k1)]),
+                b.sum_points([P, Q, P]),
+                b.sum_points([P, minus_P, Q]),
+                *b.point_mul_G_batch([k1, k2, k3]),
+            )])
+        assert all(r == results[0] for r in results)
+
+if __name__ == '__main__':
+    test_backends()
+
+    if len(sys.argv) > 3:
+        print(f'usage: {sys.argv[0]} [t] [runs]')
+        sys.exit(1)
+
+    t = int(sys.argv[1]) if len(sys.argv) > 1 else 67
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    bench_backends(t, runs)
@@ -1,8 +1,14 @@
 from collections import defaultdict
 from enum import Enum, auto
 
-from fastec import point_add, point_mul
-from roast import H, SessionContext, pre_agg, sign_agg
+import secrets
+import time
+
+from fastec import precompute
+from roast import keygen, pre_agg, pre_round, session_context, share_val_batch, sign_agg, sign_round, verify
+from tracing import timed
+
+import fastec
 
 # Enum values are used for priority (small value = high priority)
 class ActionType(Enum):
@@ -11,8 +17,32 @@ class ActionType(Enum):
     SESSION_START = 4
     SESSION_SUCCESS = 2
 
+class ShareVerification(Enum):
+    # Each share is checked with share_val as soon as it arrives
+    EAGER = 0
+    # Shares are checked together with share_val_batch by the model, once
+    # their session is complete or before their signer joins a new session
+    BATCH = 1
+    # Like BATCH, but a complete session is first checked by verifying the
+    # aggregated signature, and shares are only checked if that fails
+    OPTIMISTIC = 2
+
+class Session:
+    # What the model keeps per session: the shared context, the pre_i values
+    # its members used, the shares received so far, and how many members
+    # haven't moved on yet (by joining a newer session or turning out to be
+    # malicious). Once that reaches zero, no more shares can arrive, so a
+    # session that hasn't completed by then never will and is dropped.
+    __slots__ = ('ctx', 'i_to_pre', 'i_to_s', 'waiting')
+
+    def __init__(self, ctx, i_to_pre):
+        self.ctx = ctx
+        self.i_to_pre = i_to_pre
+        self.i_to_s = {}
+        self.waiting = len(i_to_pre)
+
 class CoordinatorModel:
-    def __init__(self, X, i_to_X, t, n, msg):
+    def __init__(self, X, i_to_X, t, n, msg, share_verification=ShareVerification.EAGER):
         assert len(i_to_X) == n
         assert 2 <= t <= n
 
@@ -21,22 +51,56 @@ class CoordinatorModel:
         self.t = t
         self.n = n
         self.msg = msg
+        self.share_verification = share_verification
+
+        self.precompute_keys()
 
         # Invariants:
         #   len(self.ready) < t
         #   len(self.malicious) <= n - t
+        #   len(self.sid_to_session) <= n - len(self.malicious)
         self.ready = set()
         self.malicious = set()
 
+        # Latest pre_i value of each participant, and the session each
+        # participant that hasn't moved on yet belongs to
         self.i_to_pre = {}
         self.i_to_sid = {}
 
-        # TODO: Is it possible to just store sid_to_ctx?
         self.sid_ctr = 0
-        self.sid_to_T = {}
-        self.sid_to_R = {}
-        self.sid_to_pre = {}
-        self.sid_to_i_to_s = defaultdict(dict)
+        self.sid_to_session = {}
+
+        # Only used when shares aren't verified eagerly: the participants
+        # whose latest share has not been verified yet
+        self.unverified = set()
+
+        # RunTrace set by the coordinator if tracing is on
+        self.trace = None
+
+    # All the cryptography the model needs goes through these methods, so a
+    # subclass can replace it (see simulate.py)
+    def precompute_keys(self):
+        # X and i_to_X stay the same across runs, so this is only
+        # expensive for the first model
+        precompute([self.X, *self.i_to_X.values()])
+
+    def new_session_context(self, T):
+        pre = pre_agg(self.i_to_pre, T)
+        return session_context(self.X, self.i_to_X, self.msg, T, pre)
+
+    def aggregate(self, ctx, i_to_s):
+        return sign_agg(ctx, i_to_s)
+
+    def is_valid_signature(self, ctx, sig):
+        return verify(ctx, sig)
+
+    def invalid_shares(self, session, i_to_s):
+        return share_val_batch(session.ctx, session.i_to_pre, i_to_s)
+
+    def share_context(self, i):
+        # Context for checking a share of participant i with share_val
+        session = self.sid_to_session[self.i_to_sid[i]]
+        return session.ctx._replace(pre_i=session.i_to_pre[i])
 
     def handle_incoming(self, i, s_i, pre_i, share_is_valid):
         if i in self.malicious:
@@ -47,44 +111,145 @@ class CoordinatorModel:
             return (ActionType.NO_OP, None)
 
         if s_i is not None:
-            if not share_is_valid:
+            if self.share_verification == ShareVerification.EAGER and not share_is_valid:
                 self.mark_malicious(i)
                 return (ActionType.NO_OP, None)
 
             sid = self.i_to_sid[i]
-            T = self.sid_to_T[sid]
-            ctx = SessionContext(self.X, self.i_to_X, self.msg, T, self.sid_to_R[sid], self.sid_to_pre[sid], self.i_to_pre[i])
-            self.sid_to_i_to_s[sid][i] = s_i
-
-            if len(self.sid_to_i_to_s[sid]) == self.t:
-                sig = sign_agg(ctx, self.sid_to_i_to_s[sid])
-                return (ActionType.SESSION_SUCCESS, (ctx, sig, sid))
+            session = self.sid_to_session[sid]
+            session.i_to_s[i] = s_i
+
+            if self.share_verification != ShareVerification.EAGER:
+                self.unverified.add(i)
+
+            if len(session.i_to_s) == self.t:
+                if self.share_verification == ShareVerification.OPTIMISTIC:
+                    # A valid signature means that all shares are valid
+                    sig = self.aggregate(session.ctx, session.i_to_s)
+                    if self.is_valid_signature(session.ctx, sig):
+                        self.unverified.difference_update(session.i_to_s)
+                        return (ActionType.SESSION_SUCCESS, (session.ctx, sig, sid))
+                if self.share_verification != ShareVerification.EAGER:
+                    self.verify_shares(session, session.i_to_s)
+                    if i in self.malicious:
+                        return (ActionType.NO_OP, None)
+                if len(session.i_to_s) == self.t:
+                    sig = self.aggregate(session.ctx, session.i_to_s)
+                    return (ActionType.SESSION_SUCCESS, (session.ctx, sig, sid))
 
         self.i_to_pre[i] = pre_i
         self.ready.add(i)
+        if len(self.ready) == self.t and self.share_verification != ShareVerification.EAGER:
+            # A participant must not join a new session with an unverified
+            # share, otherwise a malicious participant could keep sending
+            # invalid shares in sessions that never complete.
+            sid_to_i_to_s = defaultdict(dict)
+            for j in self.ready & self.unverified:
+                sid = self.i_to_sid[j]
+                sid_to_i_to_s[sid][j] = self.sid_to_session[sid].i_to_s[j]
+            for sid, i_to_s in sid_to_i_to_s.items():
+                self.verify_shares(self.sid_to_session[sid], i_to_s)
+
         if len(self.ready) == self.t:
             self.sid_ctr += 1
             sid = self.sid_ctr
-            T = set(self.ready)
-            pre = pre_agg(self.i_to_pre, T)
-            D, E = pre
-            b = H('non', self.X, self.msg, D, E)
-            R = point_add(D, point_mul(E, b))
+            T = tuple(sorted(self.ready))
+            ctx = timed(self.trace, 'session_context', self.new_session_context, T, sid=sid)
+            i_to_pre = {i: self.i_to_pre[i] for i in T}
             for i in T:
+                self.leave_session(i)
                 self.i_to_sid[i] = sid
-            self.sid_to_T[sid] = T
-            self.sid_to_R[sid] = R
-            self.sid_to_pre[sid] = pre
+            self.sid_to_session[sid] = Session(ctx, i_to_pre)
             self.ready.clear()
-
-            data = []
-            for i in T:
-                ctx = SessionContext(self.X, self.i_to_X, self.msg, T, R, pre, self.i_to_pre[i])
-                data.append((ctx, i))
-            return (ActionType.SESSION_START, data)
+            return (ActionType.SESSION_START, (sid, ctx, i_to_pre))
 
         return (ActionType.NO_OP, None)
 
+    def leave_session(self, i):
+        sid = self.i_to_sid.pop(i, None)
+        if sid is None:
+            return
+        session = self.sid_to_session[sid]
+        session.waiting -= 1
+        if session.waiting == 0:
+            del self.sid_to_session[sid]
+
+    def verify_shares(self, session, i_to_s):
+        invalid = self.invalid_shares(session, i_to_s)
+        self.unverified.difference_update(i_to_s)
+        for j in invalid:
+            del session.i_to_s[j]
+            self.mark_malicious(j)
+
     def mark_malicious(self, i):
         self.malicious.add(i)
         assert len(self.malicious) <= self.n - self.t
+        self.leave_session(i)
+        if self.share_verification != ShareVerification.EAGER:
+            # Invalid shares are only detected after the fact, so the
+            # participant may already be waiting for the next session
+            self.ready.discard(i)
+            self.unverified.discard(i)
+
+def test_precompute_keys(n=300):
+    # With more keys than fit in the default table cache, the cache has to
+    # stay within its size, and only the first model for a key set should
+    # build any tables
+    X, *Xs = fastec.point_mul_G_batch([1 + secrets.randbelow(fastec.n - 1) for _ in range(n + 1)])
+    i_to_X = dict(enumerate(Xs, 1))
+    CoordinatorModel(X, i_to_X, 2, n, b'')
+    tables = dict(fastec.backend.key_tables)
+    assert len(tables) == min(n + 1, fastec.backend.key_table_cache_size)
+    start = time.perf_counter()
+    CoordinatorModel(X, i_to_X, 2, n, b'')
+    elapsed = time.perf_counter() - start
+    assert len(fastec.backend.key_tables) == len(tables)
+    assert all(fastec.backend.key_tables[key] is table for key, table in tables.items())
+    print(f'Second model with n = {n} built no tables ({elapsed:.4f} s)')
+
+def test_deferred_share_verification():
+    # With t = 2 and n = 4: participant 1 sends an invalid share in a session
+    # that then completes (caught when the session is checked), and
+    # participant 3 one in a session that never completes (caught when it is
+    # about to join a new session). Both have to be found, and the honest
+    # participants have to finish a later session without them.
+    t, n = 2, 4
+    i_to_sk, X, i_to_X = keygen(t, n)
+    for share_verification in (ShareVerification.BATCH, ShareVerification.OPTIMISTIC):
+        model = CoordinatorModel(X, i_to_X, t, n, b'', share_verification)
+        i_to_nonce = {}
+        sid_to_ctx = {}
+
+        def incoming(i, s_i):
+            spre_i, pre_i = i_to_nonce[i] = pre_round()
+            action_type, data = model.handle_incoming(i, s_i, pre_i, True)
+            if action_type == ActionType.SESSION_START:
+                sid, ctx, _ = data
+                sid_to_ctx[sid] = ctx
+            return action_type, data
+
+        def share(i, valid=True):
+            ctx = sid_to_ctx[model.i_to_sid[i]]
+            s_i = sign_round(X, ctx.msg, ctx.T, ctx.pre, i, i_to_sk[i], i_to_nonce[i][0])
+            return incoming(i, s_i if valid else (s_i + 1) % fastec.n)
+
+        for i in (1, 2, 3, 4):
+            incoming(i, None)
+        assert {sid: ctx.T for sid, ctx in sid_to_ctx.items()} == {1: (1, 2), 2: (3, 4)}
+
+        assert share(1, valid=False)[0] == ActionType.NO_OP
+        assert share(2)[0] == ActionType.NO_OP
+        assert model.malicious == {1}
+        assert share(3, valid=False)[0] == ActionType.NO_OP
+        assert model.malicious == {1, 3}
+        assert share(4)[0] == ActionType.SESSION_START
+        assert sid_to_ctx[3].T == (2, 4)
+
+        assert share(2)[0] == ActionType.NO_OP
+        action_type, (ctx, sig, sid) = share(4)
+        assert action_type == ActionType.SESSION_SUCCESS and sid == 3
+        assert verify(ctx, sig)
+
+if __name__ == '__main__':
+    test_deferred_share_verification()
+    test_precompute_keys()
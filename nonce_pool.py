@@ -0,0 +1,79 @@
+from multiprocessing import Lock, Process, RawArray, RawValue, Semaphore
+from struct import Struct
+
+from fastec import point_to_affine_bytes, point_from_affine_bytes
+from roast import pre_round_batch
+
+# A pool of precomputed nonces (spre_i, pre_i) shared between the processes
+# of a participant. Nonces are stored as fixed-width records in a ring buffer
+# in shared memory, so taking one doesn't need any pickling, and are produced
+# by worker processes that generate them in batches.
+#
+# The pool keeps track of its low watermark (the smallest number of nonces
+# left after a get) and of how many gets had to wait for a worker, which
+# should stay at zero if the pool is deep enough for bursts of sessions.
+NONCE_POOL_DEPTH = 256
+NONCE_POOL_WORKERS = 1
+NONCE_POOL_BATCH = 16
+
+# d_i, e_i, D_i, E_i (points as affine x and y)
+nonce_record = Struct('<32s32s64s64s')
+
+class NoncePool:
+    def __init__(self, depth=NONCE_POOL_DEPTH, workers=NONCE_POOL_WORKERS, batch=NONCE_POOL_BATCH):
+        self.depth = depth
+        self.workers = workers
+        self.batch = min(batch, depth)
+        self.buf = memoryview(RawArray('B', depth * nonce_record.size)).cast('B')
+        # Number of nonces put into and taken out of the pool so far
+        self.head = RawValue('q', 0)
+        self.tail = RawValue('q', 0)
+        self.lock = Lock()
+        self.free = Semaphore(depth)
+        self.filled = Semaphore(0)
+        self.low_watermark = RawValue('q', depth)
+        self.gets = RawValue('q', 0)
+        self.waits = RawValue('q', 0)
+
+    def start(self):
+        for _ in range(self.workers):
+            Process(target=self.fill_loop, daemon=True).start()
+
+    def fill_loop(self):
+        while True:
+            records = []
+            for (d_i, e_i), (D_i, E_i) in pre_round_batch(self.batch):
+                records.append(nonce_record.pack(
+                    d_i.to_bytes(32, 'big'), e_i.to_bytes(32, 'big'),
+                    point_to_affine_bytes(D_i), point_to_affine_bytes(E_i),
+                ))
+            for record in records:
+                self.free.acquire()
+                with self.lock:
+                    offset = self.tail.value % self.depth * nonce_record.size
+                    self.buf[offset:offset + nonce_record.size] = record
+                    self.tail.value += 1
+                self.filled.release()
+
+    def get(self, block=True):
+        # Without block, returns None instead of waiting for a worker
+        if not self.filled.acquire(block=False):
+            if not block:
+                return None
+            with self.lock:
+                self.waits.value += 1
+            self.filled.acquire()
+        with self.lock:
+            offset = self.head.value % self.depth * nonce_record.size
+            d_i, e_i, D_i, E_i = nonce_record.unpack_from(self.buf, offset)
+            self.head.value += 1
+            self.gets.value += 1
+            self.low_watermark.value = min(self.low_watermark.value, self.tail.value - self.head.value)
+        self.free.release()
+        spre_i = (int.from_bytes(d_i, 'big'), int.from_bytes(e_i, 'big'))
+        pre_i = (point_from_affine_bytes(D_i), point_from_affine_bytes(E_i))
+        return spre_i, pre_i
+
+    def stats(self):
+        with self.lock:
+            return f'depth = {self.tail.value - self.head.value}/{self.depth}, low_watermark = {self.low_watermark.value}, gets = {self.gets.value}, waits = {self.waits.value}'
@@ -1,60 +1,125 @@
-from multiprocessing import Process, Queue
-from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, IPPROTO_TCP, TCP_NODELAY
+from collections import OrderedDict
+from itertools import count
 
+import asyncio
 import logging
+import os
 import sys
 import time
 
-from roast import pre_round, sign_round
-from transport import send_obj, recv_obj
+from nonce_pool import NoncePool, NONCE_POOL_DEPTH, NONCE_POOL_WORKERS
+from roast import sign_round
+from transport import MAX_RUNS, encode_frame, read_obj
 
-MAX_NONCE_QUEUE = 32
+# Precomputed nonces are kept in a NoncePool with ROAST_NONCE_POOL_DEPTH
+# entries, filled by ROAST_NONCE_POOL_WORKERS processes
+NONCE_POOL_DEPTH = int(os.environ.get('ROAST_NONCE_POOL_DEPTH', NONCE_POOL_DEPTH))
+NONCE_POOL_WORKERS = int(os.environ.get('ROAST_NONCE_POOL_WORKERS', NONCE_POOL_WORKERS))
+# With ROAST_NONCE_BATCH=k, a participant keeps k nonce commitments uploaded
+# to each coordinator ahead of time, so that the coordinator can start a run
+# without waiting for an initial pre_i. Used nonces are replaced in one
+# NONCES message when the next run starts.
+NONCE_BATCH = int(os.environ.get('ROAST_NONCE_BATCH', 0))
 
 class Participant:
-    def __init__(self, X, i, sk_i, nonce_queue):
+    def __init__(self, X, i, sk_i, nonce):
         self.X = X
         self.i = i
         self.sk_i = sk_i
-        self.nonce_queue = nonce_queue
-        self.spre_i, self.pre_i = nonce_queue.get()
+        self.spre_i, self.pre_i = nonce
 
-    def sign_round(self, msg, T, pre):
+    def sign_round(self, msg, T, pre, next_nonce):
         s_i = sign_round(self.X, msg, T, pre, self.i, self.sk_i, self.spre_i)
-        self.spre_i, self.pre_i = self.nonce_queue.get()
+        self.spre_i, self.pre_i = next_nonce
         return s_i, self.pre_i
 
-def handle_requests(connection, nonce_queue):
-    curr_run_id = -1
+async def get_nonce(nonce_pool):
+    # Only waits for a worker in a separate thread, so that an empty pool
+    # doesn't hold up the other connections
+    nonce = nonce_pool.get(block=False)
+    if nonce is None:
+        nonce = await asyncio.get_running_loop().run_in_executor(None, nonce_pool.get)
+    return nonce
+
+async def upload_nonces(writer, run_id, i, id_to_nonce, nonce_ids, nonce_pool):
+    # Tops up the nonces uploaded to the coordinator to NONCE_BATCH
+    nonces = []
+    while len(id_to_nonce) < NONCE_BATCH:
+        nonce_id = next(nonce_ids)
+        id_to_nonce[nonce_id] = await get_nonce(nonce_pool)
+        nonces.append((nonce_id, id_to_nonce[nonce_id][1]))
+    if nonces:
+        writer.write(encode_frame((run_id, (i, None, nonces))))
+        logging.debug(f'Participant {i}: Uploaded {len(nonces)} nonce commitments')
+
+async def handle_requests(reader, writer, nonce_pool):
+    # Each coordinator connection has its own runs and uploaded nonces; only
+    # the nonce pool is shared
+    # Least recently used run first
+    run_id_to_participant = OrderedDict()
+    # Uploaded nonces that the coordinator hasn't used yet
+    id_to_nonce = {}
+    nonce_ids = count()
 
     while True:
-        obj = recv_obj(connection)
+        obj = await read_obj(reader)
         if obj is None:
             logging.debug('Connection closed')
             break
 
         run_id, data = obj
-        if run_id < curr_run_id:
-            logging.debug(f'Participant {i}: Ignoring incoming message from outdated run (run_id = {run_id}, curr_run_id = {curr_run_id})')
-        elif run_id > curr_run_id:
-            X, i, sk_i = data
-            logging.debug(f'Participant {i}: Received initialization data for new run (run_id = {run_id}, curr_run_id = {curr_run_id})')
-            curr_run_id = run_id
-            participant = Participant(X, i, sk_i, nonce_queue)
-            send_obj(connection, (run_id, (i, None, participant.pre_i)))
-            logging.debug(f'Participant {i}: Sent initial pre_i value')
+        if type(data[0]) is not bytes:
+            X, i, sk_i, *nonce_id = data
+            logging.debug(f'Participant {i}: Received initialization data for new run (run_id = {run_id})')
+            if nonce_id:
+                # The coordinator already has pre_i from an earlier upload
+                nonce = id_to_nonce.pop(nonce_id[0], None)
+                if nonce is None:
+                    logging.info(f'Participant {i}: Ignoring run with unknown nonce id {nonce_id[0]} (run_id = {run_id})')
+                    continue
+                participant = Participant(X, i, sk_i, nonce)
+            else:
+                participant = Participant(X, i, sk_i, await get_nonce(nonce_pool))
+                writer.write(encode_frame((run_id, (i, None, participant.pre_i))))
+                logging.debug(f'Participant {i}: Sent initial pre_i value')
+            run_id_to_participant[run_id] = participant
+            if len(run_id_to_participant) > MAX_RUNS:
+                run_id_to_participant.popitem(last=False)
+            await upload_nonces(writer, run_id, i, id_to_nonce, nonce_ids, nonce_pool)
+        elif run_id not in run_id_to_participant:
+            logging.debug(f'Participant: Ignoring incoming message from outdated or unknown run (run_id = {run_id})')
         else:
+            participant = run_id_to_participant[run_id]
+            run_id_to_participant.move_to_end(run_id)
+            i = participant.i
             msg, T, pre, is_malicious = data
             logging.info(f'Participant {i}: Received sign_round request, run_id = {run_id}, is_malicious = {is_malicious}')
             if not is_malicious:
                 start = time.time()
-                s_i, pre_i = participant.sign_round(msg, T, pre)
+                s_i, pre_i = participant.sign_round(msg, T, pre, await get_nonce(nonce_pool))
                 elapsed = time.time() - start
-                send_obj(connection, (run_id, (i, s_i, pre_i)))
+                writer.write(encode_frame((run_id, (i, s_i, pre_i))))
                 logging.info(f'Participant {i}: Sent sign_round response and next pre_i value in {elapsed:.4f} seconds')
-
-def compute_nonce_loop(nonce_queue):
-    while True:
-        nonce_queue.put(pre_round())
+        await writer.drain()
+
+async def handle_connection(reader, writer, nonce_pool):
+    src = writer.get_extra_info('peername')
+    logging.debug(f'Accepted connection from {src}')
+    try:
+        await handle_requests(reader, writer, nonce_pool)
+    except ConnectionResetError:
+        logging.info('Participant: Connection reset by coordinator (which most likely has terminated).')
+    finally:
+        writer.close()
+    logging.info(f'Participant: Nonce pool {nonce_pool.stats()}')
+
+async def serve(port, nonce_pool):
+    # Serves any number of coordinator connections at the same time
+    addr = ('0.0.0.0', port)
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(reader, writer, nonce_pool), *addr)
+    logging.debug(f'Listening for incoming connections on {addr}')
+    async with server:
+        await server.serve_forever()
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
@@ -63,25 +128,8 @@ if __name__ == '__main__':
         print(f'usage: {sys.argv[0]} <port>')
         sys.exit(1)
 
-    nonce_queue = Queue(MAX_NONCE_QUEUE)
-    Process(target=compute_nonce_loop, args=[nonce_queue], daemon=True).start()
+    nonce_pool = NoncePool(NONCE_POOL_DEPTH, NONCE_POOL_WORKERS)
+    nonce_pool.start()
 
     port = int(sys.argv[1])
-    addr = ('0.0.0.0', port)
-
-    sock = socket(AF_INET, SOCK_STREAM)
-    sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, True)
-    sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, True)
-    sock.bind(addr)
-    sock.listen()
-
-    while True:
-        logging.debug(f'Listening for incoming connections on {addr}')
-
-        connection, src = sock.accept()
-        logging.debug('Accepted connection from {src}')
-
-        try:
-            handle_requests(connection, nonce_queue)
-        except ConnectionResetError:
-            logging.info('Participant: Connection reset by coordinator (which most likely has terminated).')
+    asyncio.run(serve(port, nonce_pool))
@@ -1,69 +1,138 @@
 from collections import namedtuple
+from multiprocessing import Pool
 
 import hashlib
+import os
 import secrets
+import time
 
 from fastec import (
-    G, n, infinity,
-    Point, point_add, point_mul,
-    bytes_from_point, int_from_bytes,
+    n, generator, is_infinity, point,
+    point_add, point_mul, point_mul_G, point_mul_G_batch, multi_mul, sum_points,
+    bytes_from_point, hash_to_scalar, int_from_bytes,
 )
 
-from shamir import lagrange
-
-# This implementation can be sped up by storing the midstate after hashing
-# tag_hash instead of rehashing it all the time.
-def tagged_hash(tag: str, msg: bytes) -> bytes:
-    tag_hash = hashlib.sha256(tag.encode()).digest()
-    return hashlib.sha256(tag_hash + tag_hash + msg).digest()
-
-def H(tag, *items):
-    buf = bytearray()
-    for item in items:
-        if type(item) is Point:
-            buf.extend(bytes_from_point(item))
-        else:
-            buf.extend(item)
-    return int_from_bytes(tagged_hash(tag, bytes(buf))) % n
+from shamir import lagrange, lagrange_all, poly_eval, random_polynomial
+
+H = hash_to_scalar
+
+# Spread keygen over all cores when there are at least this many participants
+KEYGEN_PARALLEL_THRESHOLD = 1000
+
+def keygen_shares(coeffs, xs):
+    # Returns affine coordinates instead of points, since points unpickled
+    # from a worker process don't belong to the parent's curve object
+    i_to_sk = {x: poly_eval(coeffs, x) for x in xs}
+    i_to_xy = {x: (X.x, X.y) for x, X in zip(xs, point_mul_G_batch(list(i_to_sk.values())))}
+    return i_to_sk, i_to_xy
+
+def deal_shares(coeffs, k, processes=None):
+    if processes is None:
+        processes = os.cpu_count() if k >= KEYGEN_PARALLEL_THRESHOLD else 1
+    xs = list(range(1, k + 1))
+    if processes <= 1:
+        results = [keygen_shares(coeffs, xs)]
+    else:
+        # The table for G has already been built by the caller, so forked
+        # workers inherit it
+        size = -(-k // processes)
+        chunks = [xs[j:j + size] for j in range(0, k, size)]
+        with Pool(processes) as pool:
+            results = pool.starmap(keygen_shares, [(coeffs, chunk) for chunk in chunks])
+    i_to_sk = {}
+    i_to_X = {}
+    for chunk_sk, chunk_xy in results:
+        i_to_sk.update(chunk_sk)
+        i_to_X.update((i, point(*xy)) for i, xy in chunk_xy.items())
+    return i_to_sk, i_to_X
+
+def keygen(t, k, processes=None):
+    # This is insecure; in practice we'd use DKG, but since
+    # key generation is not the focus of the ROAST protocol, we will
+    # keep the implementation simple by having the coordinator
+    # act as a centralized dealer.
+    sk = 1 + secrets.randbelow(n - 1)
+    coeffs = random_polynomial(sk, t)
+    X = point_mul_G(sk)
+    i_to_sk, i_to_X = deal_shares(coeffs, k, processes)
+    return i_to_sk, X, i_to_X
 
 def pre_round():
     d_i = 1 + secrets.randbelow(n - 1)
     e_i = 1 + secrets.randbelow(n - 1)
-    D_i = point_mul(G, d_i)
-    E_i = point_mul(G, e_i)
+    D_i, E_i = point_mul_G_batch([d_i, e_i])
     spre_i = (d_i, e_i)
     pre_i = (D_i, E_i)
     return spre_i, pre_i
 
+def pre_round_batch(count):
+    # Same as calling pre_round count times, but all 2 * count points share
+    # a single field inversion
+    spres = [(1 + secrets.randbelow(n - 1), 1 + secrets.randbelow(n - 1)) for _ in range(count)]
+    points = point_mul_G_batch([k for spre_i in spres for k in spre_i])
+    return [(spre_i, (points[2 * j], points[2 * j + 1])) for j, spre_i in enumerate(spres)]
+
 def pre_agg(i_to_pre, T):
-    D = infinity
-    E = infinity
-    for i in T:
-        D_i, E_i = i_to_pre[i]
-        D = point_add(D, D_i)
-        E = point_add(E, E_i)
+    D = sum_points(i_to_pre[i][0] for i in T)
+    E = sum_points(i_to_pre[i][1] for i in T)
     pre = (D, E)
     return pre
 
-SessionContext = namedtuple('SessionContext', ['X', 'i_to_X', 'msg', 'T', 'R', 'pre', 'pre_i'])
+SessionContext = namedtuple('SessionContext', ['X', 'i_to_X', 'msg', 'T', 'R', 'pre', 'pre_i', 'b', 'c', 'i_to_lambda'])
+
+def session_context(X, i_to_X, msg, T, pre):
+    # Everything that is the same for all members of a session is computed
+    # once here, so that checking a share doesn't need to hash or compute
+    # Lagrange coefficients. The pre_i field is filled in per participant.
+    D, E = pre
+    b = H('non', X, msg, D, E)
+    R = point_add(D, point_mul(E, b))
+    c = H('sig', X, msg, R)
+    i_to_lambda = lagrange_all(T)
+    return SessionContext(X, i_to_X, msg, T, R, pre, None, b, c, i_to_lambda)
 
 def share_val(ctx, i, s_i):
-    X = ctx.X
     X_i = ctx.i_to_X[i]
-    msg = ctx.msg
-    T = ctx.T
-    R = ctx.R
-    D, E = ctx.pre
     D_i, E_i = ctx.pre_i
+    b = ctx.b
+    c = ctx.c
+    lambda_i = ctx.i_to_lambda[i]
 
-    b = H('non', X, msg, D, E)
-    c = H('sig', X, msg, R)
-    lambda_i = lagrange(T, i)
-    lhs = point_mul(G, s_i)
-    rhs = point_add(point_add(D_i, point_mul(E_i, b)), point_mul(X_i, c * lambda_i % n))
+    lhs = point_mul_G(s_i)
+    rhs = sum_points((D_i, point_mul(E_i, b), point_mul(X_i, c * lambda_i % n)))
     return lhs == rhs
 
+def share_val_batch(ctx, i_to_pre, i_to_s):
+    # Checks all shares at once using a random linear combination
+    #   sum(z_i * s_i) * G == sum(z_i * (D_i + b * E_i + c * lambda_i * X_i))
+    # so that a single multi-scalar multiplication replaces three
+    # multiplications per share. Returns the set of participants whose
+    # shares are invalid, which requires checking each share on its own,
+    # but only when the combined check fails.
+    b = ctx.b
+    c = ctx.c
+    s = 0
+    pairs = []
+    for i, s_i in i_to_s.items():
+        D_i, E_i = i_to_pre[i]
+        z_i = 1 + secrets.randbits(128)
+        s = (s + z_i * s_i) % n
+        pairs.append((D_i, n - z_i))
+        pairs.append((E_i, n - z_i * b % n))
+        pairs.append((ctx.i_to_X[i], n - z_i * c * ctx.i_to_lambda[i] % n))
+    pairs.append((generator(), s))
+    if is_infinity(multi_mul(pairs)):
+        return set()
+
+    invalid = set()
+    for i, s_i in i_to_s.items():
+        if not share_val(ctx._replace(pre_i=i_to_pre[i]), i, s_i):
+            invalid.add(i)
+    return invalid
+
 def sign_round(X, msg, T, pre, i, sk_i, spre_i):
+    # Unlike the coordinator, a participant only needs b, c and its own
+    # lambda_i once per session, so there is nothing to share here.
     D, E = pre
 
     d_i, e_i = spre_i
@@ -95,6 +164,64 @@ def verify(ctx, sig):
 
     R, s = sig
     c = H('sig', X, msg, R)
-    lhs = point_mul(G, s)
+    lhs = point_mul_G(s)
     rhs = point_add(R, point_mul(X, c))
     return lhs == rhs
+
+def bench_H(runs=100000):
+    # Compare against hashing the tag and a concatenated buffer on every call
+    def H_uncached(tag, *items):
+        buf = bytearray()
+        for item in items:
+            if isinstance(item, bytes):
+                buf.extend(item)
+            else:
+                buf.extend(bytes_from_point(item))
+        tag_hash = hashlib.sha256(tag.encode()).digest()
+        return int_from_bytes(hashlib.sha256(tag_hash + tag_hash + bytes(buf)).digest()) % n
+
+    X = point_mul_G(1 + secrets.randbelow(n - 1))
+    D = point_mul_G(1 + secrets.randbelow(n - 1))
+    E = point_mul_G(1 + secrets.randbelow(n - 1))
+    msg = secrets.token_bytes(32)
+    assert H('non', X, msg, D, E) == H_uncached('non', X, msg, D, E)
+
+    for name, f in [('uncached', H_uncached), ('midstate', H)]:
+        start = time.perf_counter()
+        for _ in range(runs):
+            f('non', X, msg, D, E)
+        elapsed = time.perf_counter() - start
+        print(f'{name}: {elapsed / runs * 1e6:.3f} us per H call')
+
+def test_keygen(t=3, k=20):
+    # The parallel and serial paths have to give the same, usable points
+    coeffs = random_polynomial(1 + secrets.randbelow(n - 1), t)
+    point_mul_G(1)
+    serial = deal_shares(coeffs, k, processes=1)
+    parallel = deal_shares(coeffs, k, processes=2)
+    assert serial == parallel
+    i_to_sk, i_to_X = parallel
+    assert all(point_mul_G(i_to_sk[i]) == i_to_X[i] for i in i_to_X)
+
+def test_share_val_batch(t=5, k=7):
+    # Finds exactly the invalid shares when valid and invalid ones are mixed
+    i_to_sk, X, i_to_X = keygen(t, k)
+    msg = secrets.token_bytes(32)
+    T = tuple(sorted(secrets.SystemRandom().sample(range(1, k + 1), t)))
+    i_to_nonce = {i: pre_round() for i in T}
+    i_to_pre = {i: pre_i for i, (_, pre_i) in i_to_nonce.items()}
+    ctx = session_context(X, i_to_X, msg, T, pre_agg(i_to_pre, T))
+    i_to_s = {i: sign_round(X, msg, T, ctx.pre, i, i_to_sk[i], i_to_nonce[i][0]) for i in T}
+    assert share_val_batch(ctx, i_to_pre, i_to_s) == set()
+    for bad in ({T[0]}, {T[1], T[-1]}):
+        i_to_bad_s = {i: (s_i + 1) % n if i in bad else s_i for i, s_i in i_to_s.items()}
+        assert share_val_batch(ctx, i_to_pre, i_to_bad_s) == bad
+    # Shares that are valid on their own, but used with another pre_i
+    i_to_swapped_pre = {**i_to_pre, T[0]: i_to_pre[T[1]], T[1]: i_to_pre[T[0]]}
+    assert share_val_batch(ctx, i_to_swapped_pre, i_to_s) == {T[0], T[1]}
+    assert verify(ctx, sign_agg(ctx, i_to_s))
+
+if __name__ == '__main__':
+    test_keygen()
+    test_share_val_batch()
+    bench_H()
@@ -0,0 +1,79 @@
+from multiprocessing import RawArray, RawValue
+from struct import Struct
+
+from fastec import point_to_affine_bytes, point_from_affine_bytes
+from roast import SessionContext
+
+# Sessions are shared between the coordinator's main loop, which adds a
+# record for every session it starts, and the processes verifying incoming
+# shares, which look up the record of a participant's current session
+# directly instead of each receiving a pickled SessionContext.
+#
+# Records are keyed by (run_id, sid) and appended to a ring buffer in shared
+# memory. Positions count the bytes written since the table was created, and
+# space is reserved before it is written, so a reader can tell whether a
+# record was overwritten while reading it. Starting a new run skips a whole
+# buffer ahead, which drops the records of all earlier runs at once.
+SESSION_TABLE_SIZE = 1 << 24
+
+# run_id, sid, number of members, b, c
+record_header = Struct('<III32s32s')
+# i, lambda_i, X_i, D_i, E_i (points as affine x and y)
+member_layout = Struct('<I32s64s64s64s')
+
+def scalar_to_bytes(k):
+    return k.to_bytes(32, 'big')
+
+class SessionTable:
+    def __init__(self, n, size=SESSION_TABLE_SIZE):
+        self.size = size
+        self.buf = memoryview(RawArray('B', size))
+        self.end = RawValue('q', 0)
+        # For each participant: run_id, sid and the positions of the record
+        # of its current session and of its own entry in that record
+        self.current = RawArray('q', 4 * (n + 1))
+
+    def clear(self):
+        self.end.value += self.size
+
+    def add(self, run_id, sid, ctx, i_to_pre):
+        members = sorted(i_to_pre)
+        size = record_header.size + len(members) * member_layout.size
+        if size > self.size:
+            raise ValueError(f'Session with {len(members)} members does not fit into a table of {self.size} bytes')
+        # Records don't wrap around the end of the buffer
+        pos = self.end.value
+        if pos % self.size + size > self.size:
+            pos += self.size - pos % self.size
+        self.end.value = pos + size
+
+        offset = pos % self.size
+        record_header.pack_into(self.buf, offset, run_id, sid, len(members), scalar_to_bytes(ctx.b), scalar_to_bytes(ctx.c))
+        offset += record_header.size
+        for i in members:
+            D_i, E_i = i_to_pre[i]
+            member_layout.pack_into(
+                self.buf, offset, i, scalar_to_bytes(ctx.i_to_lambda[i]),
+                point_to_affine_bytes(ctx.i_to_X[i]), point_to_affine_bytes(D_i), point_to_affine_bytes(E_i),
+            )
+            self.current[4 * i:4 * i + 4] = [run_id, sid, pos, pos + offset - pos % self.size]
+            offset += member_layout.size
+
+    def lookup(self, run_id, i):
+        # Returns a SessionContext with everything share_val needs to check
+        # a share of participant i in the given run, or None if the session
+        # is not in the table (anymore)
+        if not 0 < i < len(self.current) // 4:
+            return None
+        current_run_id, sid, pos, member_pos = self.current[4 * i:4 * i + 4]
+        if current_run_id != run_id:
+            return None
+        record_run_id, record_sid, _, b, c = record_header.unpack_from(self.buf, pos % self.size)
+        j, lambda_i, X_i, D_i, E_i = member_layout.unpack_from(self.buf, member_pos % self.size)
+        if self.end.value > pos + self.size or (record_run_id, record_sid, j) != (run_id, sid, i):
+            return None
+        return SessionContext(
+            None, {i: point_from_affine_bytes(X_i)}, None, None, None, None,
+            (point_from_affine_bytes(D_i), point_from_affine_bytes(E_i)),
+            int.from_bytes(b, 'big'), int.from_bytes(c, 'big'), {i: int.from_bytes(lambda_i, 'big')},
+        )
@@ -1,20 +1,38 @@
 from fastec import n
+from functools import lru_cache
 from random import sample
 
 import secrets
 
 def poly_eval(coeffs, x):
+    # Horner's rule, starting from the highest coefficient
     y = 0
-    for i, c_i in enumerate(coeffs):
-        y = (y + c_i * pow(x, i, n)) % n
+    for c_i in reversed(coeffs):
+        y = (y * x + c_i) % n
     return y
 
-inverse_cache = {}
+# Bounded, so that a long-running coordinator doesn't keep every inverse it
+# has ever needed; modinv.cache_info() reports hits and misses.
+INVERSE_CACHE_SIZE = 1024
 
+@lru_cache(maxsize=INVERSE_CACHE_SIZE)
 def modinv(x):
-    if x not in inverse_cache:
-        inverse_cache[x] = pow(x, n - 2, n)
-    return inverse_cache[x]
+    return pow(x, n - 2, n)
+
+def batch_modinv(xs):
+    # Montgomery's trick: a single exponentiation for the product of all
+    # values, and three multiplications per value to recover each inverse
+    prefix = []
+    acc = 1
+    for x in xs:
+        prefix.append(acc)
+        acc = acc * x % n
+    acc_inv = pow(acc, n - 2, n)
+    inverses = [None] * len(xs)
+    for idx in reversed(range(len(xs))):
+        inverses[idx] = acc_inv * prefix[idx] % n
+        acc_inv = acc_inv * xs[idx] % n
+    return inverses
 
 def lagrange(T, i):
     lamb_i = 1
@@ -24,11 +42,31 @@ def lagrange(T, i):
             lamb_i = lamb_i * modinv(j - i) % n
     return lamb_i
 
-def split_secret(secret, t, k):
+def lagrange_all(T):
+    # lambda_i = prod(j) / (i * prod(j - i)) for j in T, j != i, where
+    # the products in the numerator are the same for every i
+    T = list(T)
+    num = 1
+    for j in T:
+        num = num * j % n
+    dens = []
+    for i in T:
+        den = i
+        for j in T:
+            if j != i:
+                den *= j - i
+        dens.append(den % n)
+    return {i: num * den_inv % n for i, den_inv in zip(T, batch_modinv(dens))}
+
+def random_polynomial(secret, t):
     # Generate random polynomial of degree t - 1
     coeffs = [secret]
     for i in range(t - 1):
         coeffs.append(1 + secrets.randbelow(n - 1))
+    return coeffs
+
+def split_secret(secret, t, k):
+    coeffs = random_polynomial(secret, t)
 
     # Evaluate polynomial at points 1, ..., k to generate shares
     shares = {}
@@ -38,10 +76,10 @@ def split_secret(secret, t, k):
     return shares
 
 def recover_secret(shares):
-    T = list(shares.keys())
+    i_to_lambda = lagrange_all(shares.keys())
     z = 0
     for i, y in shares.items():
-        z = (z + lagrange(T, i) * y) % n
+        z = (z + i_to_lambda[i] * y) % n
     return z
 
 def test_shamir():
@@ -49,8 +87,10 @@ def test_shamir():
         for t in range(2, k):
             secret = 1 + secrets.randbelow(n - 1)
             all_shares = split_secret(secret, t, k)
-            threshold_shares = dict(sample(all_shares.items(), t))
+            threshold_shares = dict(sample(list(all_shares.items()), t))
             assert recover_secret(threshold_shares) == secret
+            T = threshold_shares.keys()
+            assert lagrange_all(T) == {i: lagrange(T, i) for i in T}
 
 if __name__ == '__main__':
     test_shamir()
@@ -0,0 +1,199 @@
+from heapq import heappop, heappush
+
+import random
+import sys
+import time
+
+from coordinator import AttackerLevel, AttackerStrategy
+from model import ActionType, CoordinatorModel, ShareVerification
+from participant import Participant
+from roast import SessionContext, keygen, pre_round, share_val, verify
+
+# Discrete-event simulation of a signing run: the coordinator is the real
+# CoordinatorModel and AttackerStrategy, but participants and the network
+# are simulated, and time is a virtual clock driven by a LatencyModel
+# instead of sockets and processes. Results have the same CSV columns as
+# bench_all.py, with elapsed in virtual seconds.
+#
+# With crypto enabled, participants really sign and the coordinator checks
+# shares and the final signature, which validates the protocol but is about
+# as slow as a real run. Without it, the model skips all cryptography (see
+# NoCryptoModel) and only the message flow is simulated, so configurations
+# with thousands of participants take seconds.
+
+# RTT between the servers in benchmarks/v2
+DEFAULT_RTT = 0.153
+
+class LatencyModel:
+    # How long messages and computations take, in seconds. The defaults are
+    # rough measurements of the pure Python implementation on one core;
+    # subclass and override any of the methods to model a different
+    # network or implementation (e.g. per-participant delays).
+    def __init__(self, rtt=DEFAULT_RTT, jitter=0.0, sign_time=0.0023, session_time=0.0036,
+                 share_times=None, seed=None):
+        self.rtt = rtt
+        self.jitter = jitter
+        self.sign_time = sign_time
+        self.session_time = session_time
+        # Coordinator time per incoming share: a share_val in EAGER mode,
+        # a share in share_val_batch in BATCH mode, and sign_agg + verify
+        # spread over the t shares in OPTIMISTIC mode
+        self.share_times = share_times or {
+            ShareVerification.EAGER: 0.0030,
+            ShareVerification.BATCH: 0.0014,
+            ShareVerification.OPTIMISTIC: 0.00002,
+        }
+        self.rng = random.Random(seed)
+
+    def network_delay(self, i):
+        # One-way delay between the coordinator and participant i
+        if not self.jitter:
+            return self.rtt / 2
+        return self.rtt / 2 + self.rng.uniform(0, self.jitter)
+
+    def participant_time(self, i):
+        # Time for participant i to compute a share and its next nonce
+        return self.sign_time
+
+    def coordinator_time(self, share_verification, is_share, starts_session):
+        # Time for the coordinator to handle one incoming message
+        cost = self.share_times[share_verification] if is_share else 0.0
+        if starts_session:
+            cost += self.session_time
+        return cost
+
+class NoCryptoModel(CoordinatorModel):
+    # CoordinatorModel without any cryptography: honest shares are always
+    # valid, since simulated malicious participants never respond
+    def precompute_keys(self):
+        pass
+
+    def new_session_context(self, T):
+        return SessionContext(self.X, self.i_to_X, self.msg, T, None, None, None, None, None, None)
+
+    def aggregate(self, ctx, i_to_s):
+        return None
+
+    def is_valid_signature(self, ctx, sig):
+        return True
+
+    def invalid_shares(self, session, i_to_s):
+        return ()
+
+class Simulation:
+    def __init__(self, model, attacker_strategy, latency, i_to_sk=None):
+        # Runs real participants if i_to_sk is given, which needs a model
+        # with real keys
+        self.model = model
+        self.attacker_strategy = attacker_strategy
+        self.latency = latency
+        self.i_to_sk = i_to_sk
+        self.now = 0.0
+        self.events = []
+        self.seq = 0
+        # Both sides handle their messages one at a time, in arrival order
+        self.coordinator_free = 0.0
+        self.i_to_free = {}
+        self.i_to_participant = {}
+        self.send_count = 0
+        self.recv_count = 0
+        self.result = None
+
+    def schedule(self, at, handler, *args):
+        # seq breaks ties in arrival order
+        self.seq += 1
+        heappush(self.events, (at, self.seq, handler, args))
+
+    def send(self, at, i, data):
+        self.send_count += 1
+        self.schedule(at + self.latency.network_delay(i), self.participant_incoming, i, data)
+
+    def participant_incoming(self, i, data):
+        start = max(self.now, self.i_to_free.get(i, 0.0))
+        if data is None:
+            # INIT
+            nonce = pre_round() if self.i_to_sk else (None, None)
+            if self.i_to_sk:
+                self.i_to_participant[i] = Participant(self.model.X, i, self.i_to_sk[i], nonce)
+            s_i, pre_i = None, nonce[1]
+            done = start
+        else:
+            msg, T, pre, is_malicious = data
+            if is_malicious:
+                return
+            done = start + self.latency.participant_time(i)
+            if self.i_to_sk:
+                s_i, pre_i = self.i_to_participant[i].sign_round(msg, T, pre, pre_round())
+            else:
+                s_i, pre_i = 0, None
+        self.i_to_free[i] = done
+        self.schedule(done + self.latency.network_delay(i), self.coordinator_incoming, i, s_i, pre_i)
+
+    def coordinator_incoming(self, i, s_i, pre_i):
+        model = self.model
+        self.recv_count += 1
+        share_is_valid = True
+        if s_i is not None and self.i_to_sk and model.share_verification == ShareVerification.EAGER:
+            share_is_valid = i in model.i_to_sid and i not in model.malicious and share_val(model.share_context(i), i, s_i)
+        action_type, data = model.handle_incoming(i, s_i, pre_i, share_is_valid)
+
+        done = max(self.now, self.coordinator_free) + self.latency.coordinator_time(
+            model.share_verification, s_i is not None, action_type == ActionType.SESSION_START)
+        self.coordinator_free = done
+
+        if action_type == ActionType.SESSION_START:
+            sid, ctx, _ = data
+            session_malicious = self.attacker_strategy.choose_malicious(ctx.T, sid)
+            for j in ctx.T:
+                self.send(done, j, (ctx.msg, ctx.T, ctx.pre, j in session_malicious))
+        elif action_type == ActionType.SESSION_SUCCESS:
+            self.result = (done, data)
+
+    def run(self):
+        # Same results as Coordinator.run, with elapsed in virtual seconds
+        for i in self.model.i_to_X:
+            self.send(0.0, i, None)
+        while self.result is None:
+            self.now, _, handler, args = heappop(self.events)
+            handler(*args)
+        elapsed, (ctx, sig, sid) = self.result
+        if self.i_to_sk:
+            assert verify(ctx, sig)
+        return elapsed, self.send_count, self.recv_count, sid
+
+def simulate(t, n, f, attacker_level, share_verification=ShareVerification.EAGER, latency=None, keys=None, msg=b''):
+    # keys is the result of keygen(t, n) to run with real cryptography, or
+    # None to skip it
+    latency = latency or LatencyModel()
+    if keys:
+        i_to_sk, X, i_to_X = keys
+        model = CoordinatorModel(X, i_to_X, t, n, msg, share_verification)
+    else:
+        i_to_sk = None
+        model = NoCryptoModel(None, dict.fromkeys(range(1, n + 1)), t, n, msg, share_verification)
+    return Simulation(model, AttackerStrategy(attacker_level, n, f), latency, i_to_sk).run()
+
+if __name__ == '__main__':
+    if len(sys.argv) not in range(4, 8):
+        print(f'usage: {sys.argv[0]} <t> <n> <runs_per_config> [share_verification] [crypto] [f_step]')
+        sys.exit(1)
+
+    t = int(sys.argv[1])
+    n = int(sys.argv[2])
+    runs_per_config = int(sys.argv[3])
+    share_verification = ShareVerification(int(sys.argv[4])) if len(sys.argv) > 4 else ShareVerification.EAGER
+    crypto = len(sys.argv) > 5 and sys.argv[5] == '1'
+    f_step = int(sys.argv[6]) if len(sys.argv) > 6 else 1
+
+    keys = keygen(t, n) if crypto else None
+    latency = LatencyModel()
+
+    start = time.time()
+    with open(f'roast_{t}_{n}_sim.csv', 'w') as outfile:
+        print("t,n,f,attacker_level,elapsed,send_cnt,recv_cnt,success_session_id", file=outfile)
+        for f in range(0, n - t + 1, f_step):
+            for attacker_level in AttackerLevel:
+                for _ in range(runs_per_config):
+                    elapsed, send_count, recv_count, sid = simulate(t, n, f, attacker_level, share_verification, latency, keys)
+                    print(t, n, f, attacker_level, elapsed, send_count, recv_count, sid, sep=',', file=outfile)
+    print(f'Simulated t = {t}, n = {n} in {time.time() - start:.2f} seconds')
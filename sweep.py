@@ -0,0 +1,262 @@
+from collections import Counter
+from multiprocessing import Process, Queue
+from socket import create_connection
+
+import csv
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from coordinator import AttackerLevel, AttackerStrategy, make_coordinator
+from model import CoordinatorModel, ShareVerification
+from roast import keygen
+
+import fastec
+
+# Runs bench_all.py's sweep for a list of (t, n, f, attacker_level)
+# configurations, with jobs worker processes at once. Each worker
+# launches its own local participants (on its own range of ports) for the
+# configuration it is running, and tears them down when it moves on to a
+# different (t, n).
+#
+# Results are appended to roast_{t}_{n}.csv as soon as each run finishes,
+# and runs that are already in the file are skipped, so an interrupted
+# sweep can be restarted with the same arguments.
+CSV_HEADER = ['t', 'n', 'f', 'attacker_level', 'elapsed', 'send_cnt', 'recv_cnt', 'success_session_id']
+
+# How long to wait for newly launched participants to accept connections
+PARTICIPANT_STARTUP_TIMEOUT = 30
+
+def parse_level(name):
+    # Number or name of an AttackerLevel
+    try:
+        return AttackerLevel(int(name)) if name.isdigit() else AttackerLevel[name.upper()]
+    except (KeyError, ValueError):
+        raise ValueError(f'Unknown attacker level {name!r}') from None
+
+def parse_configs(spec):
+    # Comma-separated t:n[:f[:level]] entries of (t, n, f, attacker_level)
+    # configurations, where a missing f or level (or *) stands for all of
+    # them, e.g. 3:5,11:15:2,34:50:*:ADAPTIVE
+    configs = []
+    for item in spec.split(','):
+        parts = item.split(':')
+        if not 2 <= len(parts) <= 4:
+            raise ValueError(f'Invalid configuration {item!r}')
+        t, n = int(parts[0]), int(parts[1])
+        f_part, level_part = (parts[2:] + ['*', '*'])[:2]
+        fs = range(n - t + 1) if f_part == '*' else [int(f_part)]
+        levels = list(AttackerLevel) if level_part == '*' else [parse_level(level_part)]
+        if not 2 <= t <= n or not all(0 <= f <= n - t for f in fs):
+            raise ValueError(f'Invalid configuration {item!r}')
+        configs.extend((t, n, f, level) for f in fs for level in levels)
+    return configs
+
+def csv_path(t, n):
+    return f'roast_{t}_{n}.csv'
+
+def completed_runs(t, n):
+    # Number of runs per (f, attacker_level) already in the output file. A
+    # sweep that was interrupted can leave a partial last line, which
+    # doesn't count (see drop_partial_row).
+    done = Counter()
+    try:
+        with open(csv_path(t, n), newline='') as infile:
+            lines = (line for line in infile if line.endswith('\n'))
+            for row in csv.DictReader(lines):
+                if len(row) != len(CSV_HEADER) or None in row.values():
+                    continue
+                done[int(row['f']), row['attacker_level']] += 1
+    except FileNotFoundError:
+        pass
+    return done
+
+def drop_partial_row(path):
+    # Cuts off a last line without a newline, so that new rows don't get
+    # appended to it
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+def pending_work(configs, runs_per_config):
+    # (t, n, f, attacker_level, runs) for everything that still has to run
+    work = []
+    tn_to_done = {}
+    for t, n, f, attacker_level in configs:
+        if (t, n) not in tn_to_done:
+            tn_to_done[t, n] = completed_runs(t, n)
+        runs = runs_per_config - tn_to_done[t, n][f, str(attacker_level)]
+        if runs > 0:
+            work.append((t, n, f, attacker_level, runs))
+    return work
+
+class LocalParticipants:
+    # n participant processes on consecutive ports, each in its own process
+    # group so that its nonce pool workers are stopped together with it
+    def __init__(self, start_port, n):
+        self.i_to_addr = {i + 1: ('localhost', start_port + i) for i in range(n)}
+        self.processes = []
+
+    def __enter__(self):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'participant.py')
+        for _, port in self.i_to_addr.values():
+            self.processes.append(subprocess.Popen(
+                [sys.executable, script, str(port)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+            ))
+        deadline = time.time() + PARTICIPANT_STARTUP_TIMEOUT
+        for addr in self.i_to_addr.values():
+            while True:
+                try:
+                    create_connection(addr).close()
+                    break
+                except OSError:
+                    if time.time() > deadline:
+                        self.__exit__()
+                        raise
+                    time.sleep(0.1)
+        return self
+
+    def __exit__(self, *exc):
+        for process in self.processes:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for process in self.processes:
+            process.wait()
+        self.processes = []
+
+def sweep_worker(start_port, work, results, share_verification):
+    # Runs work items until there are none left. The participants, keys and
+    # coordinator are kept for as long as consecutive items have the same
+    # (t, n).
+    current = None
+    participants = None
+    coordinator = None
+    try:
+        while True:
+            item = work.get()
+            if item is None:
+                break
+            t, n, f, attacker_level, runs = item
+            if current != (t, n):
+                if coordinator is not None:
+                    coordinator.close()
+                    participants.__exit__()
+                current = (t, n)
+                participants = LocalParticipants(start_port, n).__enter__()
+                i_to_sk, X, i_to_X = keygen(t, n)
+                # Before the coordinator forks any processes, so that they
+                # inherit the tables
+                fastec.precompute([X, *i_to_X.values()])
+                coordinator = make_coordinator(n, share_verification)
+                coordinator.setup(participants.i_to_addr)
+            for _ in range(runs):
+                model = CoordinatorModel(X, i_to_X, t, n, b'', share_verification)
+                attacker_strategy = AttackerStrategy(attacker_level, n, f)
+                elapsed, send_count, recv_count, sid = coordinator.run(i_to_sk, model, attacker_strategy)
+                results.put((t, n, f, attacker_level, elapsed, send_count, recv_count, sid))
+    finally:
+        if coordinator is not None:
+            coordinator.close()
+            participants.__exit__()
+        results.put(None)
+
+def sweep(configs, runs_per_config, start_port, jobs, share_verification=ShareVerification.EAGER):
+    pending = pending_work(configs, runs_per_config)
+    total = sum(item[-1] for item in pending)
+    print(f'{total} runs to do, {len(configs) * runs_per_config - total} already done')
+    if not pending:
+        return
+
+    # Items are queued in order of (t, n), so that workers rarely have to
+    # restart their participants
+    work = Queue()
+    for item in pending:
+        work.put(item)
+    jobs = min(jobs, len(pending))
+    for _ in range(jobs):
+        work.put(None)
+
+    results = Queue()
+    max_n = max(config[1] for config in configs)
+    workers = [
+        Process(target=sweep_worker, args=(start_port + k * max_n, work, results, share_verification))
+        for k in range(jobs)
+    ]
+    for worker in workers:
+        worker.start()
+
+    outfiles = {}
+    done = 0
+    running = jobs
+    try:
+        while running:
+            row = results.get()
+            if row is None:
+                running -= 1
+                continue
+            t, n = row[:2]
+            outfile = outfiles.get((t, n))
+            if outfile is None:
+                path = csv_path(t, n)
+                if os.path.exists(path):
+                    drop_partial_row(path)
+                is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+                outfile = outfiles[t, n] = open(path, 'a')
+                if is_new:
+                    print(*CSV_HEADER, sep=',', file=outfile)
+            print(*row, sep=',', file=outfile)
+            outfile.flush()
+            done += 1
+            print(f'Finished run {done} of {total} (t = {t}, n = {n}, f = {row[2]}, attacker_level = {row[3]})')
+    finally:
+        for outfile in outfiles.values():
+            outfile.close()
+        for worker in workers:
+            worker.join()
+    if done < total:
+        print(f'{total - done} runs failed, run the sweep again to retry them')
+
+def test_resume(runs_per_config=2):
+    # Runs already in the output file are skipped, but not a partial row
+    # left by an interrupted sweep
+    configs = parse_configs('2:3:1:ADAPTIVE,2:3:0:1')
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with open(csv_path(2, 3), 'w') as outfile:
+                print(*CSV_HEADER, sep=',', file=outfile)
+                for _ in range(runs_per_config):
+                    print(2, 3, 1, AttackerLevel.ADAPTIVE, 0.1, 7, 6, 2, sep=',', file=outfile)
+                print(2, 3, 0, AttackerLevel.STATIC_COORDINATION, 0.1, 5, 5, 1, sep=',', file=outfile)
+                outfile.write('2,3,0,AttackerLevel.STATIC_COORD')
+            assert pending_work(configs, runs_per_config) == [(2, 3, 0, AttackerLevel.STATIC_COORDINATION, 1)]
+            drop_partial_row(csv_path(2, 3))
+            with open(csv_path(2, 3)) as infile:
+                assert infile.read().endswith('5,5,1\n')
+        finally:
+            os.chdir(cwd)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    test_resume()
+
+    if len(sys.argv) not in range(4, 7):
+        print(f'usage: {sys.argv[0]} <start_port> <configs> <runs_per_config> [jobs] [share_verification]')
+        sys.exit(1)
+
+    start_port = int(sys.argv[1])
+    configs = parse_configs(sys.argv[2])
+    runs_per_config = int(sys.argv[3])
+    jobs = int(sys.argv[4]) if len(sys.argv) > 4 else os.cpu_count()
+    share_verification = ShareVerification(int(sys.argv[5])) if len(sys.argv) > 5 else ShareVerification.EAGER
+
+    sweep(configs, runs_per_config, start_port, jobs, share_verification)
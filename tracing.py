@@ -0,0 +1,120 @@
+from collections import defaultdict
+
+import json
+import os
+import time
+
+# Per-phase latency tracing for the coordinators. Tracing is off unless
+# ROAST_TRACE=1 or ROAST_TRACE_FILE is set, in which case every run gets a
+# RunTrace with a histogram of the durations recorded for each phase, and
+# with ROAST_TRACE_FILE every single duration is also appended to that file
+# as a JSON line. When tracing is off, coordinators only check whether their
+# tracer is None.
+#
+# Phases recorded by the coordinators (in seconds):
+#
+#   queue_wait:<ACTION>   time an action spent in the action queue
+#   serialize             encoding INIT frames and SIGN frames of a session
+#   init_round_trip       from queueing INIT until pre_i arrived
+#   round_trip            from queueing SIGN until the share arrived
+#   share_val             checking a share with share_val
+#   session_context       pre_agg and hashing when starting a session
+#   handle_incoming       CoordinatorModel.handle_incoming, in total
+
+class Histogram:
+    # HDR-style histogram: values are recorded in nanoseconds, exactly up
+    # to 2^SUB_BUCKET_BITS and with a relative error of at most
+    # 2^-(SUB_BUCKET_BITS - 1) above that, in a bucket per power of two
+    # split into equal sub-buckets
+    SUB_BUCKET_BITS = 7
+
+    def __init__(self):
+        self.bucket_to_count = defaultdict(int)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, seconds):
+        v = max(0, int(seconds * 1e9))
+        shift = max(0, v.bit_length() - self.SUB_BUCKET_BITS)
+        # Keys increase with the values they represent
+        self.bucket_to_count[(shift << self.SUB_BUCKET_BITS) | (v >> shift)] += 1
+        self.count += 1
+        self.total += v
+        self.min = v if self.min is None else min(self.min, v)
+        self.max = max(self.max, v)
+
+    def merge(self, other):
+        for bucket, count in other.bucket_to_count.items():
+            self.bucket_to_count[bucket] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count / 1e9 if self.count else 0.0
+
+    def percentile(self, q):
+        # Highest value (in seconds) that is equivalent to the q-th
+        # percentile of the recorded values
+        if not self.count:
+            return 0.0
+        rank = max(1, -(-self.count * q // 100))
+        seen = 0
+        for bucket in sorted(self.bucket_to_count):
+            seen += self.bucket_to_count[bucket]
+            if seen >= rank:
+                shift = bucket >> self.SUB_BUCKET_BITS
+                sub_bucket = bucket & ((1 << self.SUB_BUCKET_BITS) - 1)
+                return min(((sub_bucket + 1) << shift) - 1, self.max) / 1e9
+        return self.max / 1e9
+
+    def summary(self):
+        return f'count = {self.count}, mean = {self.mean():.6f}, p50 = {self.percentile(50):.6f}, p99 = {self.percentile(99):.6f}, max = {self.max / 1e9:.6f}'
+
+class RunTrace:
+    def __init__(self, run_id, outfile):
+        self.run_id = run_id
+        self.outfile = outfile
+        self.phase_to_histogram = defaultdict(Histogram)
+
+    def record(self, phase, seconds, **fields):
+        self.phase_to_histogram[phase].record(seconds)
+        if self.outfile is not None:
+            self.outfile.write(json.dumps({'run_id': self.run_id, 'phase': phase, 'seconds': seconds, **fields}) + '\n')
+
+    def summary(self):
+        return '; '.join(f'{phase}: {histogram.summary()}' for phase, histogram in sorted(self.phase_to_histogram.items()))
+
+class Tracer:
+    def __init__(self, path=None):
+        self.outfile = open(path, 'a') if path else None
+
+    def start_run(self, run_id):
+        return RunTrace(run_id, self.outfile)
+
+    def end_run(self, trace):
+        if self.outfile is not None:
+            self.outfile.flush()
+
+    def close(self):
+        if self.outfile is not None:
+            self.outfile.close()
+
+def timed(trace, phase, fn, *args, **fields):
+    # Calls fn(*args), recording how long it took if trace isn't None
+    if trace is None:
+        return fn(*args)
+    start = time.perf_counter()
+    result = fn(*args)
+    trace.record(phase, time.perf_counter() - start, **fields)
+    return result
+
+def make_tracer():
+    path = os.environ.get('ROAST_TRACE_FILE')
+    if path or os.environ.get('ROAST_TRACE') == '1':
+        return Tracer(path)
+    return None